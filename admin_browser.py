@@ -0,0 +1,138 @@
+import logging
+import re
+from datetime import datetime
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from tiering import archive_horizon
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 10
+
+DATE_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+
+class AdminBrowser:
+    """Постраничный просмотр пользователей и пробежек для админов
+
+    Состояние страницы целиком лежит в callback_data кнопок (лимит Telegram - 64 байта):
+    br:<u|r>:<n|p>:<курсор>:<user_id>:<ГГГГММДД начала>:<ГГГГММДД конца>
+    """
+
+    def __init__(self, db, users, archive_after_days: int = 400):
+        self.db = db
+        self.users = users
+        self.archive_after_days = archive_after_days
+
+    def parse_command(self, args):
+        """Разбирает /browse users | /browse runs [user_id] [ГГГГ-ММ-ДД ГГГГ-ММ-ДД]"""
+        args = list(args or [])
+        kind = args.pop(0).lower() if args else 'runs'
+        if kind not in ('users', 'runs'):
+            raise ValueError(f"❌ Неизвестный раздел: {kind}")
+
+        user_id = start = end = None
+        if kind == 'runs':
+            if args and args[0].lstrip('-').isdigit():
+                user_id = int(args.pop(0))
+            if len(args) >= 2 and DATE_PATTERN.match(args[0]) and DATE_PATTERN.match(args[1]):
+                start = args.pop(0).replace('-', '')
+                end = args.pop(0).replace('-', '')
+        if args:
+            raise ValueError(f"❌ Непонятный аргумент: {args[0]}")
+
+        return 'u' if kind == 'users' else 'r', user_id, start, end
+
+    def parse_callback(self, data: str):
+        """Разбирает callback_data кнопки листания"""
+        _, kind, direction, cursor, user_id, start, end = data.split(':')
+        return kind, direction, cursor or None, int(user_id) if user_id else None, start or None, end or None
+
+    def _callback(self, kind, direction, cursor, user_id, start, end):
+        return f"br:{kind}:{direction}:{cursor}:{user_id if user_id is not None else ''}:{start or ''}:{end or ''}"
+
+    def render(self, kind, direction='n', cursor=None, user_id=None, start=None, end=None):
+        """Возвращает (текст, клавиатура) для страницы"""
+        if kind == 'u':
+            return self._render_users(direction, cursor)
+        return self._render_runs(direction, cursor, user_id, start, end)
+
+    def _page(self, rows, direction, cursor):
+        """Обрезает лишнюю запись и определяет, есть ли соседние страницы"""
+        backward = direction == 'p'
+        has_more = len(rows) > PAGE_SIZE
+        rows = list(rows[:PAGE_SIZE])
+        if backward:
+            rows.reverse()
+            return rows, has_more, True
+        return rows, cursor is not None, has_more
+
+    def _keyboard(self, kind, rows, has_prev, has_next, cursor_of, user_id=None, start=None, end=None):
+        buttons = []
+        if rows and has_prev:
+            buttons.append(InlineKeyboardButton(
+                "⬅️ Назад", callback_data=self._callback(kind, 'p', cursor_of(rows[0]), user_id, start, end)))
+        if rows and has_next:
+            buttons.append(InlineKeyboardButton(
+                "Вперед ➡️", callback_data=self._callback(kind, 'n', cursor_of(rows[-1]), user_id, start, end)))
+        return InlineKeyboardMarkup([buttons]) if buttons else None
+
+    def _render_users(self, direction, cursor):
+        cursor_id = int(cursor) if cursor else None
+        if direction == 'p':
+            rows = self.db.browse_users(before_id=cursor_id, limit=PAGE_SIZE)
+        else:
+            rows = self.db.browse_users(after_id=cursor_id, limit=PAGE_SIZE)
+        rows, has_prev, has_next = self._page(rows, direction, cursor)
+
+        lines = ["👥 ПОЛЬЗОВАТЕЛИ", ""]
+        for row in rows:
+            name = row['first_name'] or ''
+            if row['last_name']:
+                name += f" {row['last_name']}"
+            if row['username']:
+                name += f" (@{row['username']})"
+            lines.append(f"ID:{row['user_id']} {name} - с {str(row['registration_date'])[:10]}")
+        if not rows:
+            lines.append("Пусто")
+
+        keyboard = self._keyboard('u', rows, has_prev, has_next, lambda row: row['user_id'])
+        return "\n".join(lines), keyboard
+
+    def _render_runs(self, direction, cursor, user_id, start, end):
+        cursor_key = None
+        if cursor:
+            compact_date, run_id = cursor.split('.')
+            date = datetime.strptime(compact_date, "%Y%m%d%H%M%S").strftime("%Y-%m-%d %H:%M:%S")
+            cursor_key = (date, int(run_id))
+
+        start_date = f"{start[:4]}-{start[4:6]}-{start[6:]} 00:00:00" if start else None
+        end_date = f"{end[:4]}-{end[4:6]}-{end[6:]} 23:59:59" if end else None
+
+        rows = self.db.browse_runs(cursor_key, direction == 'p', user_id, start_date, end_date, PAGE_SIZE)
+        rows, has_prev, has_next = self._page(rows, direction, cursor)
+
+        title = "🏃 ПРОБЕЖКИ"
+        if user_id is not None:
+            title += f" {self.users.display_name(user_id)}"
+        if start_date:
+            title += f" {start_date[:10]} - {end_date[:10]}"
+        lines = [title, ""]
+        horizon = archive_horizon(self.archive_after_days)
+        if start_date and start_date < horizon.strftime("%Y-%m-%d %H:%M:%S"):
+            # Просмотр идет только по горячей таблице runs
+            lines[1:1] = [f"⚠️ Пробежки до {horizon.strftime('%Y-%m-%d')} в архиве и здесь не показаны", ""]
+        for row in rows:
+            line = (f"#{row['run_id']} {str(row['date'])[:16]} "
+                    f"{self.users.display_name(row['user_id'])} - {row['distance']} км")
+            if row['run_time']:
+                line += f", {row['run_time']}"
+            lines.append(line)
+        if not rows:
+            lines.append("Пусто")
+
+        def cursor_of(row):
+            compact_date = re.sub(r'\D', '', str(row['date']))[:14]
+            return f"{compact_date}.{row['run_id']}"
+
+        keyboard = self._keyboard('r', rows, has_prev, has_next, cursor_of, user_id, start, end)
+        return "\n".join(lines), keyboard
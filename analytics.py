@@ -0,0 +1,138 @@
+import logging
+import threading
+from datetime import datetime
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин дистанций в км: [0-5), [5-10), [10-21.1), [21.1-42.2), 42.2+
+DISTANCE_BUCKETS = np.array([5.0, 10.0, 21.1, 42.2])
+BUCKET_NAMES = ["до 5 км", "5-10 км", "10-21 км", "21-42 км", "марафон+"]
+
+TREND_WEEKS = 8
+
+
+def compute_user_analytics(rows, today=None):
+    """Считает персональную аналитику по истории пробежек пользователя
+
+    rows - последовательность (date, distance, run_time_seconds, pace_seconds)
+    """
+    if not rows:
+        return None
+
+    today = np.datetime64(today or datetime.utcnow().date(), 'D')
+
+    dates, distance, run_time, pace = zip(*rows)
+    days = np.array(dates, dtype='datetime64[s]').astype('datetime64[D]')
+    distance = np.array(distance, dtype=float)
+    # None превращается в NaN
+    run_time = np.array(run_time, dtype=float)
+    pace = np.array(pace, dtype=float)
+
+    # Темп, которого нет в записи, восстанавливаем из времени и дистанции
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pace = np.where(np.isnan(pace), run_time / distance, pace)
+    pace[(pace < 120) | (pace > 1200)] = np.nan
+
+    # 1. Лучший темп по корзинам дистанций
+    bucket = np.digitize(distance, DISTANCE_BUCKETS)
+    best_pace = {}
+    for i, name in enumerate(BUCKET_NAMES):
+        bucket_pace = pace[(bucket == i) & ~np.isnan(pace)]
+        if bucket_pace.size:
+            best_pace[name] = float(bucket_pace.min())
+
+    # 2. Недельный объем за последние TREND_WEEKS недель (0 - текущая неделя)
+    weeks_ago = (today - days).astype(int) // 7
+    recent = (weeks_ago >= 0) & (weeks_ago < TREND_WEEKS)
+    weekly_volume = np.bincount(weeks_ago[recent], weights=distance[recent], minlength=TREND_WEEKS)[::-1]
+
+    # 3. Серии: подряд идущие дни с пробежками
+    run_days = np.unique(days)
+    breaks = np.flatnonzero(np.diff(run_days).astype(int) != 1)
+    starts = np.concatenate(([0], breaks + 1))
+    ends = np.concatenate((breaks, [run_days.size - 1]))
+    lengths = ends - starts + 1
+    longest_streak = int(lengths.max())
+    # Текущая серия жива, если последняя пробежка была сегодня или вчера
+    current_streak = int(lengths[-1]) if (today - run_days[-1]).astype(int) <= 1 else 0
+
+    # 4. Нагрузка за скользящие 4 недели и предыдущие 4 недели
+    days_ago = (today - days).astype(int)
+    load_4w = float(distance[(days_ago >= 0) & (days_ago < 28)].sum())
+    prev_load_4w = float(distance[(days_ago >= 28) & (days_ago < 56)].sum())
+
+    return {
+        'total_runs': int(distance.size),
+        'total_distance': float(distance.sum()),
+        'avg_distance': float(distance.mean()),
+        'best_pace': best_pace,
+        'weekly_volume': [round(float(v), 1) for v in weekly_volume],
+        'current_streak': current_streak,
+        'longest_streak': longest_streak,
+        'load_4w': load_4w,
+        'prev_load_4w': prev_load_4w,
+    }
+
+
+class UserAnalytics:
+    """Кэш персональной аналитики; запись сбрасывается при новой пробежке пользователя"""
+
+    def __init__(self, db):
+        self.db = db
+        self._cache = {}
+        self._versions = {}
+        self._lock = threading.Lock()
+        db.add_run_listener(self.invalidate)
+
+    def invalidate(self, user_id: int):
+        """Сбрасывает кэш пользователя"""
+        with self._lock:
+            self._versions[user_id] = self._versions.get(user_id, 0) + 1
+            self._cache.pop(user_id, None)
+
+    def clear(self):
+        """Сбрасывает весь кэш (например, после переноса пробежек в архив)"""
+        with self._lock:
+            for user_id in self._cache:
+                self._versions[user_id] = self._versions.get(user_id, 0) + 1
+            self._cache.clear()
+
+    def _with_lifetime_totals(self, result, user_id: int):
+        """Итоги за все время с учетом архива; тренды и рекорды считаются по горячим данным"""
+        lifetime = self.db.get_user_stats(user_id)
+        if not lifetime['total_runs']:
+            return result
+
+        if result is None:
+            result = {
+                'best_pace': {},
+                'weekly_volume': [0.0] * TREND_WEEKS,
+                'current_streak': 0,
+                'longest_streak': 0,
+                'load_4w': 0.0,
+                'prev_load_4w': 0.0,
+            }
+        # Сколько пробежек лежит только в архиве: на них рекорды не распространяются
+        result['archived_runs'] = lifetime['total_runs'] - result.get('total_runs', 0)
+        result['total_runs'] = lifetime['total_runs']
+        result['total_distance'] = lifetime['total_distance']
+        result['avg_distance'] = lifetime['total_distance'] / lifetime['total_runs']
+        return result
+
+    def get(self, user_id: int):
+        """Возвращает аналитику пользователя, пересчитывая ее только после новых пробежек"""
+        with self._lock:
+            if user_id in self._cache:
+                return self._cache[user_id]
+            version = self._versions.get(user_id, 0)
+
+        result = compute_user_analytics(self.db.get_user_runs(user_id))
+        result = self._with_lifetime_totals(result, user_id)
+
+        with self._lock:
+            # Если пока считали, добавилась пробежка - не кэшируем устаревший результат
+            if self._versions.get(user_id, 0) == version:
+                self._cache[user_id] = result
+        return result
@@ -0,0 +1,80 @@
+import asyncio
+import glob
+import logging
+import os
+import sqlite3
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+class BackupManager:
+    """Онлайн-бэкапы базы через SQLite backup API с ротацией и проверкой целостности
+
+    Источник - соединение писателя: изменения, сделанные через него во время копирования,
+    сразу попадают в бэкап без перезапуска. Запись через любое другое соединение
+    (RunArchiver, процессы ocr_worker.py) заставляет копирование начаться с первой страницы,
+    поэтому бэкап и обслуживание базы делят общий lock и не пересекаются; от редких
+    записей воркеров OCR lock не защищает, они могут перезапустить копирование. Копируем
+    небольшими шагами по pages_per_step страниц и после каждого шага спим step_sleep секунд
+    (progress-колбэк), поэтому запись не ждет долго.
+    """
+
+    def __init__(self, db, backup_dir: str = 'backups', keep: int = 7, pages_per_step: int = 256,
+                 step_sleep: float = 0.01, lock: asyncio.Lock = None):
+        self.db = db
+        self.backup_dir = backup_dir
+        self.keep = keep
+        self.pages_per_step = pages_per_step
+        self.step_sleep = step_sleep
+        self._lock = lock or asyncio.Lock()
+
+    def _run_backup(self):
+        os.makedirs(self.backup_dir, exist_ok=True)
+        path = os.path.join(self.backup_dir, f"workouts-{datetime.now().strftime('%Y%m%d-%H%M%S')}.db")
+        tmp_path = path + '.tmp'
+        started = time.perf_counter()
+
+        def throttle(status, remaining, total):
+            # sleep= у backup() срабатывает только на BUSY/LOCKED, паузу между шагами делаем сами
+            time.sleep(self.step_sleep)
+
+        try:
+            dest = sqlite3.connect(tmp_path)
+            try:
+                self.db.conn.backup(dest, pages=self.pages_per_step, progress=throttle)
+                result = dest.execute("PRAGMA integrity_check").fetchone()[0]
+            finally:
+                dest.close()
+
+            if result != 'ok':
+                raise RuntimeError(f"❌ Бэкап не прошел проверку целостности: {result}")
+
+            os.replace(tmp_path, path)
+        except Exception:
+            # Недописанный файл не должен копиться в каталоге бэкапов
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._rotate()
+
+        return {
+            'path': path,
+            'size': os.path.getsize(path),
+            'duration': time.perf_counter() - started,
+        }
+
+    def _rotate(self):
+        """Оставляет только keep последних бэкапов"""
+        backups = sorted(glob.glob(os.path.join(self.backup_dir, 'workouts-*.db')))
+        for old in backups[:-self.keep]:
+            os.remove(old)
+            logger.info("🗑️ Удален старый бэкап: %s", old)
+
+    async def backup(self):
+        """Делает бэкап в отдельном потоке; возвращает путь, размер и длительность"""
+        async with self._lock:
+            info = await asyncio.to_thread(self._run_backup)
+        logger.info("💾 Бэкап %s: %.1f МБ за %.1f с", info['path'], info['size'] / 1024 / 1024, info['duration'])
+        return info
@@ -1,38 +1,88 @@
 #!/usr/bin/env python3
+import asyncio
+import html
+import json
 import logging
-import re
 from datetime import datetime, timedelta
 from config import Config
 from database import Database
+from dedup import RecentUpdates
+from analytics import UserAnalytics
+from ranking import RankingEngine, PAGE_SIZE
+from users import UserDirectory
+from admin_browser import AdminBrowser
+from tiering import RunArchiver, archive_horizon
+from backup import BackupManager
+from leaderboard import LeaderboardRenderer
+from ocr import load_backend
+from run_parser import RunParser
+from log_setup import setup_logging, bind_update
 from telegram import Update, ReplyKeyboardRemove
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackContext, JobQueue
-from PIL import Image, ImageEnhance, ImageFilter
-import easyocr
-import numpy as np
-from io import BytesIO
+from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, TypeHandler, filters, CallbackContext, JobQueue
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+setup_logging(
+    level=Config.LOG_LEVEL,
+    levels=Config.LOG_LEVELS,
+    sample_rates=Config.LOG_SAMPLE_RATES,
+    fmt=Config.LOG_FORMAT
 )
-logger = logging.getLogger(__name__)
+logger = logging.getLogger('bot')
 
-class RunningBot:
+class RunningBot(RunParser):
     def __init__(self):
-        self.db = Database()
+        self.db = Database(
+            read_pool_size=Config.READ_POOL_SIZE,
+            read_timeout=Config.READ_QUERY_TIMEOUT,
+            statement_cache=Config.READ_STATEMENT_CACHE,
+        )
+        self.recent_updates = RecentUpdates(Config.RECENT_UPDATES_LIMIT)
+        self.analytics = UserAnalytics(self.db)
+        self.users = UserDirectory(self.db)
+        self.ranking = RankingEngine(self.db, self.users, archive_after_days=Config.ARCHIVE_AFTER_DAYS)
+        self.browser = AdminBrowser(self.db, self.users, archive_after_days=Config.ARCHIVE_AFTER_DAYS)
+        self.archiver = RunArchiver(
+            self.db,
+            archive_after_days=Config.ARCHIVE_AFTER_DAYS,
+            batch_size=Config.ARCHIVE_BATCH_SIZE,
+            vacuum_pages=Config.VACUUM_PAGES_PER_STEP
+        )
+        self.leaderboard = LeaderboardRenderer(
+            self.db,
+            fetch_top=self.get_weekly_top,
+            format_text=self.format_weekly_top_message,
+            font_path=Config.CHART_FONT
+        )
+        # Бэкап и обслуживание не должны пересекаться: запись архиватора перезапускает бэкап
+        self.maintenance_lock = asyncio.Lock()
+        self.backups = BackupManager(
+            self.db,
+            backup_dir=Config.BACKUP_DIR,
+            keep=Config.BACKUP_KEEP,
+            pages_per_step=Config.BACKUP_PAGES_PER_STEP,
+            lock=self.maintenance_lock
+        )
         self.application = Application.builder().token(Config.BOT_TOKEN).build()
-        self.reader = easyocr.Reader(['ru', 'en'])
+        # В режиме очереди OCR делают отдельные процессы ocr_worker.py
+        self.ocr = self.setup_ocr() if Config.OCR_MODE != "queue" else None
         self.setup_handlers()
         self.setup_jobs()
     
     def setup_handlers(self):
         """Настройка обработчиков команд и сообщений"""
+        # Группа -1 выполняется первой и привязывает идентификаторы update к логам
+        self.application.add_handler(TypeHandler(Update, self.bind_log_context), group=-1)
+        
         self.application.add_handler(CommandHandler("start", self.start))
         self.application.add_handler(CommandHandler("my_stats", self.my_stats))
         self.application.add_handler(CommandHandler("group_stats", self.group_stats))
+        self.application.add_handler(CommandHandler("top", self.top))
+        self.application.add_handler(CommandHandler("my_rank", self.my_rank))
         self.application.add_handler(CommandHandler("test_weekly_top", self.test_weekly_top))
         self.application.add_handler(CommandHandler("get_chat_id", self.get_chat_id))
         self.application.add_handler(CommandHandler("debug_db", self.debug_db))
+        self.application.add_handler(CommandHandler("browse", self.browse))
+        self.application.add_handler(CommandHandler("backup", self.backup))
+        self.application.add_handler(CallbackQueryHandler(self.browse_page, pattern=r'^br:'))
         
         self.application.add_handler(MessageHandler(
             filters.TEXT & filters.ChatType.GROUPS & filters.Regex(r'#япобегал'),
@@ -46,10 +96,77 @@ class RunningBot:
         
         self.application.add_handler(MessageHandler(filters.PHOTO, self.process_image))
     
+    def setup_ocr(self):
+        """Создает OCR-движок из настроек или выбирает лучший по корпусу"""
+        return load_backend(
+            Config.OCR_BACKEND,
+            Config.OCR_FIXTURES_DIR,
+            preprocess=self.preprocess_image,
+            parse_distance=lambda text: self.extract_running_data(text)[0],
+            min_accuracy=Config.OCR_MIN_ACCURACY,
+            languages=Config.OCR_LANGUAGES,
+            threads=Config.OCR_THREADS
+        )
+    
     def setup_jobs(self):
         """Настройка автоматических заданий"""
         job_queue = self.application.job_queue
         job_queue.run_once(self.send_test_weekly_top, when=timedelta(seconds=60))
+        
+        job_queue.run_repeating(
+            self.run_maintenance,
+            interval=timedelta(hours=Config.MAINTENANCE_INTERVAL_HOURS),
+            first=timedelta(minutes=5)
+        )
+        
+        job_queue.run_repeating(
+            self.scheduled_backup,
+            interval=timedelta(hours=Config.BACKUP_INTERVAL_HOURS),
+            first=timedelta(minutes=30)
+        )
+        
+        if Config.OCR_MODE == "queue":
+            job_queue.run_repeating(self.deliver_ocr_results, interval=Config.OCR_POLL_INTERVAL, first=1)
+    
+    async def run_maintenance(self, context: CallbackContext):
+        """Архивирование старых пробежек, инкрементальный VACUUM и ANALYZE"""
+        try:
+            async with self.maintenance_lock:
+                moved = await self.archiver.archive_old_runs()
+                if moved:
+                    # Горячая история изменилась - рекорды и тренды надо пересчитать
+                    self.analytics.clear()
+                await self.archiver.vacuum_and_analyze()
+        except Exception as e:
+            logger.error(f"❌ Ошибка обслуживания базы: {e}")
+    
+    async def scheduled_backup(self, context: CallbackContext):
+        """Плановый онлайн-бэкап базы"""
+        try:
+            await self.backups.backup()
+        except Exception as e:
+            logger.error(f"❌ Ошибка планового бэкапа: {e}")
+    
+    async def backup(self, update: Update, context: CallbackContext):
+        """Ручной бэкап базы (только для админов)"""
+        if update.effective_user.id not in Config.ADMIN_IDS:
+            return
+        
+        await update.message.reply_text("💾 Делаю бэкап...")
+        try:
+            info = await self.backups.backup()
+            await update.message.reply_text(
+                f"✅ Бэкап готов и проверен\n\n"
+                f"📁 Файл: {info['path']}\n"
+                f"📦 Размер: {info['size'] / 1024 / 1024:.1f} МБ\n"
+                f"⏱️ Длительность: {info['duration']:.1f} с"
+            )
+        except Exception as e:
+            await update.message.reply_text(f"❌ Ошибка бэкапа: {e}")
+    
+    async def bind_log_context(self, update: Update, context: CallbackContext):
+        """Привязывает update_id, chat_id и user_id ко всем логам этого обновления"""
+        bind_update(update)
     
     async def get_chat_id(self, update: Update, context: CallbackContext):
         """Получить ID чата"""
@@ -59,7 +176,7 @@ class RunningBot:
     async def debug_db(self, update: Update, context: CallbackContext):
         """Детальная отладочная информация"""
         try:
-            debug_info = self.db.debug_info()
+            debug_info = await self.db.run_read(self.db.debug_info)
             
             message_lines = [
                 "🐛 ДЕТАЛЬНАЯ ОТЛАДКА БАЗЫ ДАННЫХ:",
@@ -75,356 +192,241 @@ class RunningBot:
                     f"ID:{run[0]} User:{run[1]} Dist:{run[2]} Date:{run[3]}"
                 )
             
-            # Проверяем конкретно пользователей
-            cursor = self.db.conn.cursor()
-            cursor.execute("SELECT user_id, first_name FROM users")
-            users = cursor.fetchall()
-            
-            message_lines.extend(["", "👥 ВСЕ ПОЛЬЗОВАТЕЛИ:"])
-            for user in users:
-                message_lines.append(f"ID:{user[0]} Name:{user[1]}")
+            message_lines.extend([
+                "",
+                "👥 Пользователи: /browse users",
+                "🏃 Пробежки: /browse runs [user_id] [ГГГГ-ММ-ДД ГГГГ-ММ-ДД]"
+            ])
             
             await update.message.reply_text("\n".join(message_lines))
             
         except Exception as e:
             await update.message.reply_text(f"❌ Ошибка отладки: {e}")
     
-    def extract_distance_from_text(self, message):
-        """Извлекает дистанцию из текстового сообщения"""
-        clean_message = re.sub(r'#япобегал', '', message, flags=re.IGNORECASE)
-        clean_message = re.sub(r'\s+', ' ', clean_message).strip()
-        
-        patterns = [
-            r'(\d+[.,]?\d*)\s*км',
-            r'(\d+[.,]?\d*)\s*km',
-        ]
-
-        for pattern in patterns:
-            match = re.search(pattern, clean_message, re.IGNORECASE)
-            if match:
-                try:
-                    distance_str = match.group(1).replace(',', '.')
-                    distance = float(distance_str)
-                    if 0.1 <= distance <= 100:
-                        return distance
-                except ValueError:
-                    continue
-
-        return None
-
-    def preprocess_image(self, img):
-        """Улучшение качества изображения - ПОЛНАЯ ВЕРСИЯ"""
-        img = img.convert('L')
-        enhancer = ImageEnhance.Contrast(img)
-        img = enhancer.enhance(3.0)
-        enhancer = ImageEnhance.Sharpness(img)
-        img = enhancer.enhance(3.0)
-        return img
-
-    def parse_time_to_seconds(self, time_str):
-        """Парсит время в секунды"""
-        if not time_str:
-            return None
-            
-        time_str = time_str.replace('.', ':').replace(';', ':')
-        parts = time_str.split(':')
-        
-        if len(parts) == 3:
-            try:
-                hours, minutes, seconds = map(int, parts)
-                if hours < 24 and minutes < 60 and seconds < 60:
-                    return hours * 3600 + minutes * 60 + seconds
-            except ValueError:
-                return None
-                
-        elif len(parts) == 2:
-            try:
-                minutes, seconds = map(int, parts)
-                if minutes < 60 and seconds < 60:
-                    return minutes * 60 + seconds
-            except ValueError:
-                return None
-                
-        return None
-
-    def seconds_to_time_format(self, seconds):
-        """Конвертирует секунды в формат ЧЧ:ММ:СС или ММ:СС"""
-        if not seconds:
-            return None
-            
-        hours = int(seconds // 3600)
-        minutes = int((seconds % 3600) // 60)
-        seconds = int(seconds % 60)
-        
-        if hours > 0:
-            return f"{hours}:{minutes:02d}:{seconds:02d}"
-        else:
-            return f"{minutes}:{seconds:02d}"
-
-    def seconds_to_pace_format(self, seconds):
-        """Конвертирует секунды в формат темпа ММ:СС"""
-        if not seconds:
-            return None
-        minutes = int(seconds // 60)
-        seconds = int(seconds % 60)
-        return f"{minutes}:{seconds:02d}"
-
-    def extract_running_data(self, extracted_text):
-        """Умное извлечение данных о пробежке с расчетом недостающих значений - ПОЛНАЯ ВЕРСИЯ"""
-        logger.info(f"🔍 Распознанный текст: {extracted_text}")
-        
-        extracted_text = re.sub(r'[<>&]', ' ', extracted_text)
-        extracted_text = re.sub(r'\s+', ' ', extracted_text).strip()
-        
-        distance = None
-        time_str = None
-        pace_str = None
-        time_seconds = None
-        pace_seconds = None
-        
-        # 1. ПОИСК ДИСТАНЦИИ
-        distance_patterns = [
-            r'(\d+[.,]\d+)\s*km',
-            r'(\d+[.,]\d+)\s*км',
-            r'(\d+[.,]\d+)km',
-            r'(\d+[.,]\d+)км',
-            r'расстояние[^\d]*(\d+[.,]\d+)',
-            r'дистанция[^\d]*(\d+[.,]\d+)',
-        ]
-        
-        for pattern in distance_patterns:
-            match = re.search(pattern, extracted_text, re.IGNORECASE)
-            if match:
-                try:
-                    dist = float(match.group(1).replace(',', '.'))
-                    if 0.5 <= dist <= 42.2:
-                        distance = dist
-                        logger.info(f"✅ Найдена дистанция: {distance} км")
-                        break
-                except ValueError:
-                    continue
-        
-        # Резервный поиск дистанции
-        if not distance:
-            number_pattern = r'\b(1[0-5][.,]\d{1,2})\b'
-            matches = re.findall(number_pattern, extracted_text)
-            for match in matches:
-                try:
-                    dist = float(match.replace(',', '.'))
-                    if 5.0 <= dist <= 20.0:
-                        context = extracted_text.lower()
-                        if not any(word in context for word in ['пульс', 'калори', 'уд/м', 'kcal']):
-                            distance = dist
-                            logger.info(f"✅ Найдена дистанция (резерв): {distance} км")
-                            break
-                except ValueError:
-                    continue
-        
-        # 2. ПОИСК ВРЕМЕНИ
-        time_patterns = [
-            r'(\d+:\d+:\d+)',
-            r'(\d+:\d+)',
-            r'общее\s+время[^\d]*(\d+:\d+:\d+)',
-            r'время[^\d]*(\d+:\d+:\d+)',
-            r'общее\s+время[^\d]*(\d+:\d+)',
-            r'время[^\d]*(\d+:\d+)',
-        ]
-        
-        for pattern in time_patterns:
-            match = re.search(pattern, extracted_text, re.IGNORECASE)
-            if match:
-                candidate = match.group(1)
-                seconds = self.parse_time_to_seconds(candidate)
-                if seconds and seconds >= 60:
-                    time_str = candidate
-                    time_seconds = seconds
-                    logger.info(f"✅ Найдено время: {time_str} ({time_seconds} сек)")
-                    break
-        
-        if not time_str:
-            all_time_matches = re.findall(r'\b\d{1,2}:\d{2}(?::\d{2})?\b', extracted_text)
-            for match in all_time_matches:
-                seconds = self.parse_time_to_seconds(match)
-                if seconds and seconds >= 180:
-                    time_str = match
-                    time_seconds = seconds
-                    logger.info(f"✅ Найдено время (общий поиск): {time_str}")
-                    break
-        
-        # 3. ПОИСК ТЕМПА
-        pace_patterns = [
-            (r'(\d{3})"\s*/\s*km', True),
-            (r'(\d{3})"\s*/\s*км', True),
-            (r'(\d+:\d+)\s*/\s*km', False),
-            (r'(\d+:\d+)\s*/\s*км', False),
-            (r"(\d+)'(\d+)''?", True),
-            (r'средн\.?\s*темп[^\d]*(\d+:\d+)', False),
-            (r'средний\s*темп[^\d]*(\d+:\d+)', False),
-        ]
+    async def browse(self, update: Update, context: CallbackContext):
+        """Постраничный просмотр пользователей и пробежек (только для админов)"""
+        if update.effective_user.id not in Config.ADMIN_IDS:
+            return
         
-        for pattern, needs_conversion in pace_patterns:
-            match = re.search(pattern, extracted_text, re.IGNORECASE)
-            if match:
-                if needs_conversion:
-                    if pattern.startswith(r'(\d{3})"'):
-                        num = match.group(1)
-                        if len(num) == 3:
-                            minutes = int(num[0])
-                            seconds = int(num[1:])
-                            if seconds < 60:
-                                pace_seconds = minutes * 60 + seconds
-                                pace_str = f"{minutes}:{seconds:02d}"
-                                logger.info(f"✅ Найден темп (3 цифры): {pace_str}")
-                                break
-                    elif pattern.startswith(r"(\d+)'(\d+)''?"):
-                        minutes, seconds = match.groups()
-                        pace_seconds = int(minutes) * 60 + int(seconds)
-                        pace_str = f"{minutes}:{seconds}"
-                        logger.info(f"✅ Найден темп (минуты'секунды): {pace_str}")
-                        break
-                else:
-                    pace_candidate = match.group(1)
-                    pace_seconds_candidate = self.parse_time_to_seconds(pace_candidate)
-                    if pace_seconds_candidate and 120 <= pace_seconds_candidate <= 1200:
-                        pace_seconds = pace_seconds_candidate
-                        pace_str = pace_candidate
-                        logger.info(f"✅ Найден темп: {pace_str}")
-                        break
-        
-        # 4. УМНЫЙ РАСЧЕТ НЕДОСТАЮЩИХ ДАННЫХ
-        calculated_time = None
-        calculated_pace = None
-        
-        if distance:
-            if time_seconds and not pace_seconds:
-                pace_seconds = time_seconds / distance
-                if 120 <= pace_seconds <= 1200:
-                    calculated_pace = self.seconds_to_pace_format(pace_seconds)
-                    pace_str = calculated_pace
-                    logger.info(f"🧮 ВЫЧИСЛЕН темп: {pace_str} из времени {time_str} и дистанции {distance}км")
-            
-            elif pace_seconds and not time_seconds:
-                time_seconds = pace_seconds * distance
-                if 60 <= time_seconds <= 36000:
-                    calculated_time = self.seconds_to_time_format(time_seconds)
-                    time_str = calculated_time
-                    logger.info(f"🧮 ВЫЧИСЛЕНО время: {time_str} из темпа {pace_str} и дистанции {distance}км")
-            
-            elif not time_seconds and not pace_seconds:
-                estimated_pace_seconds = 360
-                time_seconds = estimated_pace_seconds * distance
-                if 60 <= time_seconds <= 36000:
-                    calculated_time = self.seconds_to_time_format(time_seconds)
-                    time_str = calculated_time
-                    pace_str = "6:00"
-                    logger.info(f"🧮 ВЫЧИСЛЕНО примерное время: {time_str} (темп 6:00/км)")
+        try:
+            kind, user_id, start, end = self.browser.parse_command(context.args)
+        except ValueError as e:
+            await update.message.reply_text(
+                f"{e}\n\nФормат: /browse users\n"
+                f"Или: /browse runs [user_id] [ГГГГ-ММ-ДД ГГГГ-ММ-ДД]"
+            )
+            return
         
-        if calculated_time and time_str:
-            time_str = f"{time_str} (вычислено)"
+        text, keyboard = await self.db.run_read(self.browser.render, kind, 'n', None, user_id, start, end)
+        await update.message.reply_text(text, reply_markup=keyboard)
+    
+    async def browse_page(self, update: Update, context: CallbackContext):
+        """Листание страниц по кнопкам /browse"""
+        query = update.callback_query
+        if update.effective_user.id not in Config.ADMIN_IDS:
+            await query.answer("⛔ Только для админов")
+            return
         
-        if calculated_pace and pace_str:
-            pace_str = f"{pace_str} (вычислено)"
+        await query.answer()
+        try:
+            kind, direction, cursor, user_id, start, end = self.browser.parse_callback(query.data)
+            text, keyboard = await self.db.run_read(
+                self.browser.render, kind, direction, cursor, user_id, start, end
+            )
+            await query.edit_message_text(text, reply_markup=keyboard)
+        except Exception as e:
+            logger.error(f"❌ Ошибка листания /browse: {e}")
+    
+    async def is_duplicate_update(self, update: Update):
+        """Проверяет, не обрабатывали ли мы уже это обновление или сообщение"""
+        if self.recent_updates.check_and_add(update.update_id):
+            logger.info("🔁 Повторное обновление %s пропущено", update.update_id)
+            return True
         
-        logger.info(f"📊 ИТОГОВЫЕ ДАННЫЕ: дистанция={distance}, время={time_str}, темп={pace_str}")
+        message = update.effective_message
+        # run_exists ждет свободное соединение пула - выполняем его вне event loop
+        if await self.db.run_read(self.db.run_exists, update.effective_chat.id, message.message_id):
+            logger.info("🔁 Сообщение %s уже записано, пропускаем", message.message_id)
+            return True
         
-        return distance, time_str, pace_str, time_seconds, pace_seconds
-
+        return False
+    
     async def process_image(self, update: Update, context: CallbackContext):
         """Обработка изображений - ПОЛНАЯ ВЕРСИЯ"""
         try:
-            user = update.effective_user
-            logger.info(f"📸 Обработка изображения от пользователя: {user.first_name} (ID: {user.id})")
+            # Отсекаем дубликаты до скачивания и OCR
+            if await self.is_duplicate_update(update):
+                return
             
-            photo = update.message.photo[-1]
-            file_obj = await photo.get_file()
-            image_data = await file_obj.download_as_bytearray()
-            img = Image.open(BytesIO(image_data))
-            
-            img = self.preprocess_image(img)
-            img_array = np.array(img)
-            
-            results = self.reader.readtext(img_array, detail=0)
-            extracted_text = ' '.join(results)
+            user = update.effective_user
+            message = update.effective_message
+            logger.info("📸 Обработка изображения от пользователя: %s (ID: %s)", user.first_name, user.id)
             
-            distance, time_info, pace, time_seconds, pace_seconds = self.extract_running_data(extracted_text)
+            photo = message.photo[-1]
             
-            if distance:
-                # ГАРАНТИРОВАННОЕ СОХРАНЕНИЕ ПОЛЬЗОВАТЕЛЯ
-                user_saved = self.db.add_user(user.id, user.first_name, user.last_name, user.username)
-                if not user_saved:
-                    logger.error(f"❌ Не удалось сохранить пользователя {user.id}")
-                
-                # ГАРАНТИРОВАННОЕ СОХРАНЕНИЕ ПРОБЕЖКИ
-                run_id = self.db.add_run(
-                    user_id=user.id, 
-                    distance=distance,
-                    run_time=time_info,
-                    pace=pace,
-                    run_time_seconds=time_seconds,
-                    pace_seconds=pace_seconds
+            if Config.OCR_MODE == "queue":
+                # Распознает ocr_worker.py, ответ отправит deliver_ocr_results
+                job_id = self.db.enqueue_ocr_job(
+                    update.effective_chat.id, message.message_id,
+                    user.id, user.first_name, user.last_name, user.username, photo.file_id
                 )
-                
-                if run_id:
-                    message_lines = [
-                        "✅ Пробежка записана из изображения!",
-                        "",
-                        f"🏃 Бегун: {user.first_name}",
-                        f"📏 Дистанция: {distance} км",
-                    ]
-                    
-                    if time_info:
-                        message_lines.append(f"⏱️ Время: {time_info}")
-                    if pace:
-                        message_lines.append(f"🏃‍♂️ Темп: {pace}/км")
-                    
-                    message_lines.extend(["", "Так держать! 💪"])
-                    
-                    await update.message.reply_text("\n".join(message_lines))
-                    
-                    logger.info(f"✅ УСПЕХ: Пробежка сохранена для {user.first_name} - {distance} км")
-                    
+                if job_id:
+                    logger.info("📥 Изображение поставлено в очередь OCR, задание %s", job_id)
                 else:
-                    await update.message.reply_text(
-                        "❌ Ошибка сохранения пробежки в базу данных\n"
-                        "Попробуйте еще раз или напишите текстом: 5 км #япобегал"
-                    )
-                    logger.error(f"❌ КРИТИЧЕСКАЯ ОШИБКА: Не удалось сохранить пробежку для {user.id}")
-                
-            else:
-                await update.message.reply_text(
-                    "❌ Не удалось распознать пробежку на изображении\n\n"
-                    "Попробуйте:\n"
-                    "• Более четкое изображение\n"
-                    "• Или напишите текстом: 5 км #япобегал"
-                )
-                logger.warning(f"⚠️ Не распознана пробежка на изображении от {user.first_name}")
+                    logger.info("🔁 Изображение %s уже в очереди OCR", message.message_id)
+                return
+            
+            file_obj = await photo.get_file()
+            image_data = await file_obj.download_as_bytearray()
+            parsed = self.recognize_run(image_data)
+            
+            reply, _ = self.save_image_run(
+                user.id, user.first_name, user.last_name, user.username,
+                update.effective_chat.id, message.message_id, parsed
+            )
+            await message.reply_text(reply)
                 
         except Exception as e:
-            logger.error(f"❌ Ошибка при обработке изображения: {e}")
-            await update.message.reply_text(
+            logger.error("❌ Ошибка при обработке изображения: %s", e)
+            await update.effective_message.reply_text(
                 "❌ Произошла ошибка при обработке изображения\n"
                 "Попробуйте отправить текстом: 5 км #япобегал"
             )
 
+    def save_image_run(self, user_id, first_name, last_name, username, chat_id, message_id, parsed):
+        """Сохраняет распознанную со скриншота пробежку
+
+        Возвращает (текст ответа, settled): settled ложно только при сбое записи в базу,
+        когда сохранение имеет смысл повторить.
+        """
+        distance, time_info, pace, time_seconds, pace_seconds = parsed
+        
+        if not distance:
+            logger.warning("⚠️ Не распознана пробежка на изображении от %s", first_name)
+            return (
+                "❌ Не удалось распознать пробежку на изображении\n\n"
+                "Попробуйте:\n"
+                "• Более четкое изображение\n"
+                "• Или напишите текстом: 5 км #япобегал"
+            ), True
+        
+        # ГАРАНТИРОВАННОЕ СОХРАНЕНИЕ ПОЛЬЗОВАТЕЛЯ
+        user_saved = self.users.ensure(user_id, first_name, last_name, username)
+        if not user_saved:
+            logger.error("❌ Не удалось сохранить пользователя %s", user_id)
+        
+        # ГАРАНТИРОВАННОЕ СОХРАНЕНИЕ ПРОБЕЖКИ
+        run_id = self.db.add_run(
+            user_id=user_id, 
+            distance=distance,
+            run_time=time_info,
+            pace=pace,
+            run_time_seconds=time_seconds,
+            pace_seconds=pace_seconds,
+            chat_id=chat_id,
+            message_id=message_id
+        )
+        
+        if not run_id:
+            logger.error(f"❌ КРИТИЧЕСКАЯ ОШИБКА: Не удалось сохранить пробежку для {user_id}")
+            return (
+                "❌ Ошибка сохранения пробежки в базу данных\n"
+                "Попробуйте еще раз или напишите текстом: 5 км #япобегал"
+            ), False
+        
+        message_lines = [
+            "✅ Пробежка записана из изображения!",
+            "",
+            f"🏃 Бегун: {first_name}",
+            f"📏 Дистанция: {distance} км",
+        ]
+        
+        if time_info:
+            message_lines.append(f"⏱️ Время: {time_info}")
+        if pace:
+            message_lines.append(f"🏃‍♂️ Темп: {pace}/км")
+        
+        message_lines.extend(["", "Так держать! 💪"])
+        
+        logger.info("✅ УСПЕХ: Пробежка сохранена для %s - %s км", first_name, distance,
+                    extra={'run_id': run_id})
+        return "\n".join(message_lines), True
+
+    async def deliver_ocr_results(self, context: CallbackContext):
+        """Сохраняет результаты OCR-воркеров и отвечает на исходные сообщения"""
+        jobs = await self.db.run_read(self.db.get_finished_ocr_jobs)
+        
+        for job in jobs:
+            # Задание закрываем, только когда пробежка записана или результат точно непригоден
+            settled = True
+            try:
+                if job['status'] == 'done':
+                    if await self.db.run_read(self.db.run_exists, job['chat_id'], job['message_id']):
+                        # Пробежку уже записали до перезапуска бота, ответ тоже ушел
+                        continue
+                    result = json.loads(job['result'])
+                    parsed = (result['distance'], result['time_info'], result['pace'],
+                              result['time_seconds'], result['pace_seconds'])
+                    reply, settled = self.save_image_run(
+                        job['user_id'], job['first_name'], job['last_name'], job['username'],
+                        job['chat_id'], job['message_id'], parsed
+                    )
+                    if not settled:
+                        # Сбой базы: задание остается 'done' и доставляется снова, пока не кончатся попытки,
+                        # чтобы застрявшие задания не заслоняли новые
+                        if self.db.retry_ocr_delivery(job['job_id'], "Не удалось сохранить пробежку",
+                                                      Config.OCR_MAX_ATTEMPTS):
+                            logger.warning("⚠️ Пробежка OCR-задания %s не сохранена, повторим позже", job['job_id'])
+                        else:
+                            logger.error("❌ Пробежка OCR-задания %s так и не сохранилась, задание провалено",
+                                         job['job_id'])
+                        continue
+                else:
+                    logger.error("❌ OCR-задание %s провалено: %s", job['job_id'], job['error'])
+                    reply = (
+                        "❌ Произошла ошибка при обработке изображения\n"
+                        "Попробуйте отправить текстом: 5 км #япобегал"
+                    )
+                
+                await context.bot.send_message(
+                    chat_id=job['chat_id'],
+                    text=reply,
+                    reply_to_message_id=job['message_id'],
+                    allow_sending_without_reply=True
+                )
+            except Exception as e:
+                logger.error(f"❌ Ошибка доставки результата OCR-задания {job['job_id']}: {e}")
+            finally:
+                # Если пробежка уже записана, не повторяем доставку бесконечно при недоступном чате
+                if settled:
+                    self.db.mark_ocr_job_sent(job['job_id'])
+
     async def handle_group_run_message(self, update: Update, context: CallbackContext):
         """Обработчик сообщений в группах - ГАРАНТИРОВАННОЕ СОХРАНЕНИЕ"""
         try:
+            if await self.is_duplicate_update(update):
+                return
+            
             user = update.effective_user
-            message_text = update.message.text
+            message_text = update.effective_message.text
             
-            logger.info(f"💬 Обработка сообщения от {user.first_name} (ID: {user.id}): {message_text}")
+            logger.info("💬 Обработка сообщения от %s (ID: %s): %s", user.first_name, user.id, message_text)
             
             # ГАРАНТИРОВАННОЕ СОХРАНЕНИЕ ПОЛЬЗОВАТЕЛЯ
-            user_saved = self.db.add_user(user.id, user.first_name, user.last_name, user.username)
+            user_saved = self.users.ensure(user.id, user.first_name, user.last_name, user.username)
             if not user_saved:
-                logger.error(f"❌ Не удалось сохранить пользователя {user.id}")
+                logger.error("❌ Не удалось сохранить пользователя %s", user.id)
             
             # Извлекаем дистанцию
             distance = self.extract_distance_from_text(message_text)
             
             if distance:
                 # ГАРАНТИРОВАННОЕ СОХРАНЕНИЕ ПРОБЕЖКИ
-                run_id = self.db.add_run(user.id, distance)
+                run_id = self.db.add_run(
+                    user.id, distance,
+                    chat_id=update.effective_chat.id,
+                    message_id=update.effective_message.message_id
+                )
                 
                 if run_id:
                     # Отправляем подтверждение в ЛС
@@ -438,7 +440,8 @@ class RunningBot:
                                 f"Так держать! 💪"
                             )
                         )
-                        logger.info(f"✅ УСПЕХ: Пробежка сохранена для {user.first_name} - {distance} км")
+                        logger.info("✅ УСПЕХ: Пробежка сохранена для %s - %s км", user.first_name, distance,
+                                    extra={'run_id': run_id})
                         
                     except Exception as e:
                         logger.warning(f"⚠️ Не удалось отправить ЛС пользователю {user.id}: {e}")
@@ -462,28 +465,21 @@ class RunningBot:
         except Exception as e:
             logger.error(f"❌ Ошибка при обработке пробежки: {e}")
 
-    def get_weekly_top(self, days_back=3):
+    def get_weekly_top(self, days_back=7):
         """Получает топ бегунов за последние N дней"""
         try:
             top_runners_data, start_date, end_date = self.db.get_weekly_top(days_back)
             
             top_runners = []
             for row in top_runners_data:
-                first_name, last_name, username, runs_count, total_distance, avg_distance = row
-                name = first_name
-                if last_name:
-                    name += f" {last_name}"
-                if username:
-                    name += f" (@{username})"
-                
                 top_runners.append({
-                    'name': name,
-                    'runs_count': runs_count,
-                    'total_distance': round(total_distance, 1),
-                    'avg_distance': round(avg_distance, 1) if avg_distance else 0
+                    'name': self.ranking.format_name(row),
+                    'runs_count': row['runs_count'],
+                    'total_distance': round(row['total_distance'], 1),
+                    'avg_distance': round(row['avg_distance'], 1) if row['avg_distance'] else 0
                 })
             
-            logger.info(f"📊 Сформирован топ из {len(top_runners)} бегунов")
+            logger.debug("📊 Сформирован топ из %s бегунов", len(top_runners))
             return top_runners, start_date, end_date
             
         except Exception as e:
@@ -510,7 +506,7 @@ class RunningBot:
                 medal = f"{i+1}."
             
             message_lines.append(
-                f"{medal} <b>{runner['name']}</b>\n"
+                f"{medal} <b>{html.escape(runner['name'])}</b>\n"
                 f"   🏃 Пробежек: {runner['runs_count']}\n"
                 f"   📏 Дистанция: {runner['total_distance']} км\n"
                 f"   📐 В среднем: {runner['avg_distance']} км/забег"
@@ -528,18 +524,27 @@ class RunningBot:
         
         return "\n".join(message_lines)
 
+    async def post_weekly_top(self, bot, chat_id: int, days_back: int = 7):
+        """Отправляет топ текстом и графиком, используя кэш и file_id уже загруженной картинки"""
+        artifacts = await self.db.run_read(self.leaderboard.get, chat_id, days_back)
+        
+        await bot.send_message(
+            chat_id=chat_id,
+            text=artifacts['text'],
+            parse_mode='HTML'
+        )
+        
+        if artifacts['file_id']:
+            await bot.send_photo(chat_id=chat_id, photo=artifacts['file_id'])
+        elif artifacts['png']:
+            message = await bot.send_photo(chat_id=chat_id, photo=artifacts['png'])
+            self.leaderboard.remember_file_id(artifacts, message.photo[-1].file_id)
+
     async def send_test_weekly_top(self, context: CallbackContext):
         """Отправляет тестовый топ за неделю"""
         try:
             chat_id = Config.get_group_chat_id()
-            top_runners, start_date, end_date = self.get_weekly_top(days_back=7)
-            message = self.format_weekly_top_message(top_runners, start_date, end_date)
-            
-            await context.bot.send_message(
-                chat_id=chat_id,
-                text=message,
-                parse_mode='HTML'
-            )
+            await self.post_weekly_top(context.bot, chat_id, days_back=7)
             
             logger.info(f"✅ Тестовый топ отправлен в чат {chat_id}")
             
@@ -553,24 +558,78 @@ class RunningBot:
             
         try:
             chat_id = Config.get_group_chat_id()
-            top_runners, start_date, end_date = self.get_weekly_top(days_back=7)
-            message = self.format_weekly_top_message(top_runners, start_date, end_date)
-            
-            await context.bot.send_message(
-                chat_id=chat_id,
-                text=message,
-                parse_mode='HTML'
-            )
+            await self.post_weekly_top(context.bot, chat_id, days_back=7)
             
             await update.message.reply_text("✅ Тестовый топ отправлен в групповой чат!")
             
         except Exception as e:
             await update.message.reply_text(f"❌ Ошибка при отправке топа: {e}")
 
+    async def top(self, update: Update, context: CallbackContext):
+        """Рейтинг за период: /top [week|month|year|ГГГГ-ММ-ДД ГГГГ-ММ-ДД] [distance|runs|time|pace] [страница]"""
+        try:
+            window, metric, page, start_date, end_date = self.ranking.parse_args(context.args)
+        except ValueError as e:
+            await update.message.reply_text(
+                f"{e}\n\nФормат: /top [week|month|year] [distance|runs|time|pace] [страница]\n"
+                f"Или: /top 2024-01-01 2024-03-31 distance"
+            )
+            return
+        
+        rows = await self.db.run_read(self.ranking.top, start_date, end_date, metric, page)
+        archive_note = self.ranking.archive_note(start_date)
+        if not rows:
+            reply = "🏃 На этой странице рейтинга пока никого нет"
+            await update.message.reply_text(f"{reply}\n\n{archive_note}" if archive_note else reply)
+            return
+        
+        total_pages = (rows[0]['total_ranked'] + PAGE_SIZE - 1) // PAGE_SIZE
+        message_lines = [self.ranking.format_header(window, metric, start_date, end_date), ""]
+        if archive_note:
+            message_lines[1:1] = [archive_note]
+        for row in rows:
+            message_lines.append(
+                f"{row['position']}. <b>{html.escape(self.ranking.format_name(row))}</b> - {self.ranking.format_value(row, metric)}"
+            )
+        message_lines.extend(["", f"<i>Страница {page} из {total_pages}</i>"])
+        
+        await update.message.reply_text("\n".join(message_lines), parse_mode='HTML')
+
+    async def my_rank(self, update: Update, context: CallbackContext):
+        """Позиция пользователя в рейтинге: /my_rank [период] [метрика]"""
+        user = update.effective_user
+        try:
+            window, metric, _, start_date, end_date = self.ranking.parse_args(context.args)
+        except ValueError as e:
+            await update.message.reply_text(
+                f"{e}\n\nФормат: /my_rank [week|month|year] [distance|runs|time|pace]"
+            )
+            return
+        
+        rows = await self.db.run_read(self.ranking.my_rank, user.id, start_date, end_date, metric)
+        archive_note = self.ranking.archive_note(start_date)
+        me = next((row for row in rows if row['user_id'] == user.id), None)
+        if not me:
+            reply = "📊 За этот период у вас нет пробежек для рейтинга"
+            await update.message.reply_text(f"{reply}\n\n{archive_note}" if archive_note else reply)
+            return
+        
+        message_lines = [
+            self.ranking.format_header(window, metric, start_date, end_date),
+            *([archive_note] if archive_note else []),
+            f"📍 Ваше место: <b>{me['position']}</b> из {me['total_ranked']}",
+            ""
+        ]
+        for row in rows:
+            line = f"{row['position']}. {html.escape(self.ranking.format_name(row))} - {self.ranking.format_value(row, metric)}"
+            message_lines.append(f"<b>{line}</b>" if row['user_id'] == user.id else line)
+        
+        await update.message.reply_text("\n".join(message_lines), parse_mode='HTML')
+
     async def start(self, update: Update, context: CallbackContext):
         """Обработчик команды /start"""
         user = update.effective_user
-        self.db.add_user(user.id, user.first_name, user.last_name, user.username)
+        self.users.ensure(user.id, user.first_name, user.last_name, user.username)
         
         if update.effective_chat.type == "private":
             await update.message.reply_text(
@@ -582,6 +641,8 @@ class RunningBot:
                 f"Команды:\n"
                 f"/my_stats - моя статистика\n"
                 f"/group_stats - статистика группы\n"
+                f"/top - рейтинг за неделю, месяц или год\n"
+                f"/my_rank - мое место в рейтинге\n"
                 f"/test_weekly_top - тест топа бегунов\n"
                 f"/get_chat_id - получить ID чата\n"
                 f"/debug_db - отладочная информация"
@@ -596,6 +657,8 @@ class RunningBot:
             "Или используй команды:\n"
             "/my_stats - моя статистика\n"
             "/group_stats - статистика группы\n"
+            "/top - рейтинг за неделю, месяц или год\n"
+            "/my_rank - мое место в рейтинге\n"
             "/test_weekly_top - тест топа бегунов\n"
             "/get_chat_id - получить ID чата\n"
             "/debug_db - отладочная информация"
@@ -607,20 +670,38 @@ class RunningBot:
             return
             
         user = update.effective_user
-        stats = self.db.get_user_stats(user.id)
+        stats = await self.db.run_read(self.analytics.get, user.id)
         
-        if stats['total_runs'] > 0:
-            count = stats['total_runs']
-            distance = stats['total_distance']
-            avg_distance = distance / count
+        if stats:
+            text_lines = [
+                f"📊 Статистика {user.first_name}",
+                "",
+                f"🏃 Пробежек: {stats['total_runs']}",
+                f"📏 Общая дистанция: {stats['total_distance']:.1f} км",
+                f"📐 Средняя дистанция: {stats['avg_distance']:.1f} км",
+            ]
             
-            text = (
-                f"📊 Статистика {user.first_name}\n\n"
-                f"🏃 Пробежек: {count}\n"
-                f"📏 Общая дистанция: {distance:.1f} км\n"
-                f"📐 Средняя дистанция: {avg_distance:.1f} км"
-            )
-            await update.message.reply_text(text)
+            if stats['best_pace']:
+                text_lines.extend(["", "⚡ Лучший темп:"])
+                for bucket, pace_seconds in stats['best_pace'].items():
+                    text_lines.append(f"   {bucket}: {self.seconds_to_pace_format(pace_seconds)}/км")
+            
+            weekly = " · ".join(f"{volume:g}" for volume in stats['weekly_volume'])
+            text_lines.extend([
+                "",
+                f"📈 Объем по неделям, км: {weekly}",
+                f"🔥 Текущая серия: {stats['current_streak']} дн. (рекорд: {stats['longest_streak']} дн.)",
+                f"🏋️ Нагрузка за 4 недели: {stats['load_4w']:.1f} км "
+                f"(предыдущие 4 недели: {stats['prev_load_4w']:.1f} км)"
+            ])
+            if stats.get('archived_runs'):
+                horizon = archive_horizon(Config.ARCHIVE_AFTER_DAYS)
+                text_lines.extend([
+                    "",
+                    f"⚠️ Лучший темп и рекорд серии - с {horizon.strftime('%d.%m.%Y')}: "
+                    f"более ранние пробежки ({stats['archived_runs']}) в архиве и в них не учтены"
+                ])
+            await update.message.reply_text("\n".join(text_lines))
         else:
             await update.message.reply_text(
                 "📊 У вас пока нет пробежек\n\n"
@@ -632,7 +713,7 @@ class RunningBot:
         if update.effective_chat.type != "private":
             return
             
-        stats = self.db.get_all_stats()
+        stats = await self.db.run_read(self.db.get_all_stats)
         
         text = (
             f"📊 Общая статистика\n\n"
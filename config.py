@@ -7,6 +7,47 @@ class Config:
     BOT_TOKEN = os.getenv("BOT_TOKEN")
     GROUP_CHAT_ID = os.getenv("GROUP_CHAT_ID")
     ADMIN_IDS = [int(x.strip()) for x in os.getenv("ADMIN_IDS", "").split(",") if x.strip()]
+    RECENT_UPDATES_LIMIT = int(os.getenv("RECENT_UPDATES_LIMIT", "1000"))
+    
+    # Пул соединений для чтения: размер и таймаут одного запроса в секундах
+    READ_POOL_SIZE = int(os.getenv("READ_POOL_SIZE", str(min(4, os.cpu_count() or 1))))
+    READ_QUERY_TIMEOUT = float(os.getenv("READ_QUERY_TIMEOUT", "5"))
+    # Подготовленных запросов в кэше каждого соединения пула (128 - умолчание sqlite3)
+    READ_STATEMENT_CACHE = int(os.getenv("READ_STATEMENT_CACHE", "128"))
+    
+    # OCR: easyocr | easyocr-lite | tesseract | auto (выбор по корпусу OCR_FIXTURES_DIR)
+    OCR_BACKEND = os.getenv("OCR_BACKEND", "easyocr")
+    OCR_LANGUAGES = [x.strip() for x in os.getenv("OCR_LANGUAGES", "ru,en").split(",") if x.strip()]
+    OCR_THREADS = int(os.getenv("OCR_THREADS", "0")) or None
+    OCR_FIXTURES_DIR = os.getenv("OCR_FIXTURES_DIR", "ocr_fixtures")
+    OCR_MIN_ACCURACY = float(os.getenv("OCR_MIN_ACCURACY", "0.9"))
+    
+    # inline - OCR в процессе бота; queue - задания в SQLite, распознает ocr_worker.py
+    OCR_MODE = os.getenv("OCR_MODE", "inline")
+    OCR_POLL_INTERVAL = float(os.getenv("OCR_POLL_INTERVAL", "2"))
+    OCR_LEASE_SECONDS = float(os.getenv("OCR_LEASE_SECONDS", "120"))
+    OCR_MAX_ATTEMPTS = int(os.getenv("OCR_MAX_ATTEMPTS", "3"))
+    
+    # Архив: пробежки старше ARCHIVE_AFTER_DAYS уезжают в годовые таблицы
+    ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "400"))
+    ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "500"))
+    VACUUM_PAGES_PER_STEP = int(os.getenv("VACUUM_PAGES_PER_STEP", "200"))
+    MAINTENANCE_INTERVAL_HOURS = float(os.getenv("MAINTENANCE_INTERVAL_HOURS", "24"))
+    
+    # Онлайн-бэкапы: каталог, сколько хранить, период и размер шага копирования в страницах
+    BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
+    BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "7"))
+    BACKUP_INTERVAL_HOURS = float(os.getenv("BACKUP_INTERVAL_HOURS", "24"))
+    BACKUP_PAGES_PER_STEP = int(os.getenv("BACKUP_PAGES_PER_STEP", "256"))
+    
+    # TTF-шрифт с кириллицей для графика топа
+    CHART_FONT = os.getenv("CHART_FONT", "DejaVuSans.ttf")
+    
+    # Логирование: общий уровень, уровни по категориям и доли сэмплирования
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+    LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+    LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "")
+    LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
     
     @classmethod
     def validate(cls):
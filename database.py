@@ -1,18 +1,99 @@
 import os
+import asyncio
+import contextvars
+import json
 import logging
+import queue
 import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 
 logger = logging.getLogger(__name__)
 
+# Метрики рейтинга: выражение над агрегатами и направление сортировки
+RANKING_METRICS = {
+    'distance': ('total_distance', 'DESC'),
+    'runs': ('runs_count', 'DESC'),
+    'time': ('total_time', 'DESC'),
+    'pace': ('avg_pace', 'ASC'),
+}
+
+class ReadPool:
+    """Пул read-only соединений WAL, работающий в отдельном пуле потоков"""
+    
+    def __init__(self, db_path: str, size: int = 4, timeout: float = 5.0, statement_cache: int = 128):
+        self.db_path = db_path
+        self.size = size
+        self.timeout = timeout
+        self._connections = queue.Queue()
+        for _ in range(size):
+            # Размер LRU-кэша подготовленных запросов на соединение (128 - умолчание sqlite3)
+            conn = sqlite3.connect(
+                f"file:{db_path}?mode=ro", uri=True,
+                check_same_thread=False, cached_statements=statement_cache
+            )
+            conn.row_factory = sqlite3.Row
+            self._connections.put(conn)
+        self.executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix='db-read')
+    
+    @contextmanager
+    def connection(self, timeout: float = None):
+        """Выдает соединение; запрос прерывается, если не уложился в timeout секунд"""
+        timeout = timeout or self.timeout
+        conn = self._connections.get(timeout=timeout)
+        deadline = time.monotonic() + timeout
+        # Прогресс-хендлер вызывается каждые N инструкций VM и прерывает запрос по дедлайну
+        conn.set_progress_handler(lambda: time.monotonic() > deadline, 1000)
+        try:
+            yield conn
+        finally:
+            conn.set_progress_handler(None, 0)
+            self._connections.put(conn)
+    
+    def close(self):
+        """Останавливает потоки и закрывает соединения"""
+        self.executor.shutdown(wait=True)
+        while not self._connections.empty():
+            self._connections.get_nowait().close()
+
 class Database:
-    def __init__(self):
+    def __init__(self, read_pool_size: int = 4, read_timeout: float = 5.0, statement_cache: int = 128):
         self.db_path = 'workouts.db'
+        # Единственное соединение для записи
         self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
         self.conn.row_factory = sqlite3.Row
+        # Для новой базы включаем инкрементальный VACUUM (до WAL, иначе не применится)
+        self.conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        # WAL позволяет читателям работать параллельно с писателем
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.run_listeners = []
         self._init_db()
+        self.read_pool = ReadPool(
+            self.db_path, size=read_pool_size, timeout=read_timeout, statement_cache=statement_cache
+        )
         logger.info("✅ База данных инициализирована")
     
+    def add_run_listener(self, callback):
+        """Подписка на новые пробежки: callback(user_id) вызывается после сохранения"""
+        self.run_listeners.append(callback)
+    
+    def _notify_run_added(self, user_id: int):
+        for callback in self.run_listeners:
+            try:
+                callback(user_id)
+            except Exception as e:
+                logger.error(f"❌ Ошибка обработчика новой пробежки: {e}")
+    
+    async def run_read(self, func, *args):
+        """Выполняет читающий метод в пуле потоков, не блокируя event loop"""
+        loop = asyncio.get_running_loop()
+        # Копируем contextvars, чтобы логи из пула сохраняли update/chat/user ID (как asyncio.to_thread)
+        ctx = contextvars.copy_context()
+        return await loop.run_in_executor(self.read_pool.executor, ctx.run, func, *args)
+    
     def _init_db(self):
         """Инициализация базы данных"""
         cursor = self.conn.cursor()
@@ -36,6 +117,7 @@ class Database:
                 distance REAL,
                 date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 message_id INTEGER,
+                chat_id INTEGER,
                 run_time TEXT,
                 pace TEXT,
                 run_time_seconds INTEGER,
@@ -44,131 +126,414 @@ class Database:
             )
         ''')
         
+        # Старые базы (в т.ч. созданные migrate.py) могут не иметь chat_id
+        self._ensure_column(cursor, 'runs', 'chat_id', 'INTEGER')
+        
+        # Защита от повторной записи одного и того же сообщения
+        cursor.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_runs_chat_message
+            ON runs (chat_id, message_id)
+        ''')
+        
+        # Очередь OCR-заданий, общая для бота и процессов ocr_worker.py
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS ocr_jobs (
+                job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id INTEGER,
+                message_id INTEGER,
+                user_id INTEGER,
+                first_name TEXT,
+                last_name TEXT,
+                username TEXT,
+                file_id TEXT,
+                status TEXT DEFAULT 'pending',
+                attempts INTEGER DEFAULT 0,
+                delivery_attempts INTEGER DEFAULT 0,
+                worker TEXT,
+                lease_until REAL,
+                result TEXT,
+                error TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE (chat_id, message_id)
+            )
+        ''')
+        self._ensure_column(cursor, 'ocr_jobs', 'delivery_attempts', 'INTEGER DEFAULT 0')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_ocr_jobs_status ON ocr_jobs (status, job_id)')
+        
+        # Годовые итоги по пробежкам, перенесенным в архивные таблицы runs_archive_<год>
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS run_year_summary (
+                user_id INTEGER,
+                year INTEGER,
+                runs_count INTEGER DEFAULT 0,
+                total_distance REAL DEFAULT 0,
+                total_time INTEGER DEFAULT 0,
+                PRIMARY KEY (user_id, year)
+            )
+        ''')
+        
+        # История пользователя и выборки за период
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_runs_user_date ON runs (user_id, date)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_runs_date ON runs (date)')
+        
         self.conn.commit()
         logger.info("✅ Таблицы созданы/проверены")
     
+    def _ensure_column(self, cursor, table: str, column: str, column_type: str):
+        """Добавляет колонку в таблицу, если ее еще нет"""
+        cursor.execute(f"PRAGMA table_info({table})")
+        columns = [row[1] for row in cursor.fetchall()]
+        if column not in columns:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+            logger.info("✅ Добавлена колонка %s.%s", table, column)
+    
+    def run_exists(self, chat_id: int, message_id: int):
+        """Проверяет, записана ли уже пробежка из этого сообщения"""
+        try:
+            with self.read_pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT 1 FROM runs WHERE chat_id = ? AND message_id = ? LIMIT 1
+                ''', (chat_id, message_id))
+                return cursor.fetchone() is not None
+        except Exception as e:
+            logger.error(f"❌ Ошибка проверки дубликата: {e}")
+            return False
+    
     def add_user(self, user_id: int, first_name: str, last_name: str = None, username: str = None):
-        """Добавляет пользователя - УПРОЩЕННАЯ ВЕРСИЯ"""
+        """Добавляет пользователя или обновляет его имя и username"""
         try:
             cursor = self.conn.cursor()
             cursor.execute('''
-                INSERT OR IGNORE INTO users (user_id, first_name, last_name, username)
+                INSERT INTO users (user_id, first_name, last_name, username)
                 VALUES (?, ?, ?, ?)
+                ON CONFLICT (user_id) DO UPDATE SET
+                    first_name = excluded.first_name,
+                    last_name = excluded.last_name,
+                    username = excluded.username
             ''', (user_id, first_name, last_name, username))
             self.conn.commit()
-            logger.info(f"✅ Пользователь добавлен: {user_id} - {first_name}")
+            logger.debug("✅ Пользователь сохранен: %s - %s", user_id, first_name)
             return True
         except Exception as e:
             logger.error(f"❌ Ошибка добавления пользователя {user_id}: {e}")
             return False
     
     def add_run(self, user_id: int, distance: float, run_time: str = None, pace: str = None, 
-                run_time_seconds: int = None, pace_seconds: int = None):
+                run_time_seconds: int = None, pace_seconds: int = None,
+                chat_id: int = None, message_id: int = None):
         """Добавляет пробежку - ГАРАНТИРОВАННОЕ СОХРАНЕНИЕ"""
         try:
             cursor = self.conn.cursor()
             
             # ВАЖНО: Используем CURRENT_TIMESTAMP для автоматической даты
             cursor.execute('''
-                INSERT INTO runs (user_id, distance, run_time, pace, run_time_seconds, pace_seconds)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (user_id, distance, run_time, pace, run_time_seconds, pace_seconds))
+                INSERT INTO runs (user_id, distance, run_time, pace, run_time_seconds, pace_seconds,
+                                  chat_id, message_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (user_id, distance, run_time, pace, run_time_seconds, pace_seconds,
+                  chat_id, message_id))
             
             self.conn.commit()
             run_id = cursor.lastrowid
+            self._notify_run_added(user_id)
             
-            logger.info(f"✅ ПРОБЕЖКА СОХРАНЕНА: user_id={user_id}, distance={distance}, "
-                       f"time={run_time}, pace={pace}, run_id={run_id}")
+            logger.info("✅ ПРОБЕЖКА СОХРАНЕНА: user_id=%s, distance=%s, time=%s, pace=%s, run_id=%s",
+                        user_id, distance, run_time, pace, run_id, extra={'run_id': run_id})
             
             return run_id
             
+        except sqlite3.IntegrityError as e:
+            # Сообщение уже записано - повторная доставка или редактирование
+            # Неудачный INSERT оставляет открытую транзакцию и блокировку записи
+            self.conn.rollback()
+            logger.warning(f"⚠️ Дубликат пробежки: chat_id={chat_id}, message_id={message_id}: {e}")
+            return None
+            
         except Exception as e:
             logger.error(f"❌ КРИТИЧЕСКАЯ ОШИБКА СОХРАНЕНИЯ ПРОБЕЖКИ: {e}")
             # Пробуем еще раз с простым запросом
             try:
                 cursor.execute('''
-                    INSERT INTO runs (user_id, distance) VALUES (?, ?)
-                ''', (user_id, distance))
+                    INSERT INTO runs (user_id, distance, chat_id, message_id) VALUES (?, ?, ?, ?)
+                ''', (user_id, distance, chat_id, message_id))
                 self.conn.commit()
                 logger.info(f"✅ Пробежка сохранена (упрощенный запрос)")
+                self._notify_run_added(user_id)
                 return cursor.lastrowid
             except Exception as e2:
                 logger.error(f"❌ ПОЛНЫЙ СБОЙ БАЗЫ ДАННЫХ: {e2}")
                 return None
     
-    def get_user_stats(self, user_id: int):
-        """Статистика пользователя"""
+    def enqueue_ocr_job(self, chat_id: int, message_id: int, user_id: int, first_name: str,
+                        last_name: str, username: str, file_id: str):
+        """Ставит скриншот в очередь OCR; None, если это сообщение уже в очереди"""
         try:
             cursor = self.conn.cursor()
             cursor.execute('''
-                SELECT COUNT(*) as total_runs, COALESCE(SUM(distance), 0) as total_distance
-                FROM runs WHERE user_id = ?
-            ''', (user_id,))
+                INSERT OR IGNORE INTO ocr_jobs (chat_id, message_id, user_id, first_name, last_name, username, file_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (chat_id, message_id, user_id, first_name, last_name, username, file_id))
+            self.conn.commit()
+            return cursor.lastrowid if cursor.rowcount else None
+        except Exception as e:
+            logger.error(f"❌ Ошибка постановки OCR-задания: {e}")
+            return None
+    
+    def lease_ocr_job(self, worker: str, lease_seconds: float = 120, max_attempts: int = 3):
+        """Забирает следующее задание: новое или брошенное упавшим воркером"""
+        now = time.time()
+        try:
+            # BEGIN IMMEDIATE сразу берет блокировку записи, поэтому два воркера не получат одно задание
+            self.conn.execute("BEGIN IMMEDIATE")
+            while True:
+                job = self.conn.execute('''
+                    SELECT * FROM ocr_jobs
+                    WHERE status = 'pending' OR (status = 'leased' AND lease_until < ?)
+                    ORDER BY job_id
+                    LIMIT 1
+                ''', (now,)).fetchone()
+                if job is None:
+                    self.conn.commit()
+                    return None
+                
+                if job['attempts'] >= max_attempts:
+                    self.conn.execute('''
+                        UPDATE ocr_jobs SET status = 'failed', error = COALESCE(error, 'превышено число попыток')
+                        WHERE job_id = ?
+                    ''', (job['job_id'],))
+                    continue
+                
+                self.conn.execute('''
+                    UPDATE ocr_jobs SET status = 'leased', worker = ?, lease_until = ?, attempts = attempts + 1
+                    WHERE job_id = ?
+                ''', (worker, now + lease_seconds, job['job_id']))
+                self.conn.commit()
+                return job
+        except Exception as e:
+            self.conn.rollback()
+            logger.error(f"❌ Ошибка получения OCR-задания: {e}")
+            return None
+    
+    def complete_ocr_job(self, job_id: int, result: dict):
+        """Сохраняет результат распознавания"""
+        self.conn.execute('''
+            UPDATE ocr_jobs SET status = 'done', result = ?, lease_until = NULL WHERE job_id = ?
+        ''', (json.dumps(result, ensure_ascii=False), job_id))
+        self.conn.commit()
+    
+    def fail_ocr_job(self, job_id: int, error: str, retry: bool):
+        """Возвращает задание в очередь или помечает его как проваленное"""
+        self.conn.execute('''
+            UPDATE ocr_jobs SET status = ?, error = ?, lease_until = NULL WHERE job_id = ?
+        ''', ('pending' if retry else 'failed', error, job_id))
+        self.conn.commit()
+    
+    def get_finished_ocr_jobs(self, limit: int = 20):
+        """Готовые и проваленные задания, по которым бот еще не ответил"""
+        try:
+            with self.read_pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT * FROM ocr_jobs WHERE status IN ('done', 'failed')
+                    ORDER BY job_id LIMIT ?
+                ''', (limit,))
+                return cursor.fetchall()
+        except Exception as e:
+            logger.error(f"❌ Ошибка получения готовых OCR-заданий: {e}")
+            return []
+    
+    def retry_ocr_delivery(self, job_id: int, error: str, max_attempts: int = 3):
+        """Считает неудачную попытку сохранить результат; после max_attempts задание проваливается
+
+        Возвращает True, если задание еще будет доставляться повторно.
+        """
+        self.conn.execute('''
+            UPDATE ocr_jobs SET
+                delivery_attempts = delivery_attempts + 1,
+                status = CASE WHEN delivery_attempts + 1 >= ? THEN 'failed' ELSE status END,
+                error = ?
+            WHERE job_id = ?
+        ''', (max_attempts, error, job_id))
+        self.conn.commit()
+        row = self.conn.execute("SELECT status FROM ocr_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return row is not None and row['status'] == 'done'
+    
+    def mark_ocr_job_sent(self, job_id: int):
+        """Отмечает, что бот отправил ответ по заданию"""
+        self.conn.execute("UPDATE ocr_jobs SET status = 'sent' WHERE job_id = ?", (job_id,))
+        self.conn.commit()
+    
+    def get_user_stats(self, user_id: int):
+        """Статистика пользователя"""
+        try:
+            with self.read_pool.connection() as conn:
+                cursor = conn.cursor()
+                # Свежие пробежки плюс годовые итоги архива
+                cursor.execute('''
+                    SELECT SUM(total_runs), SUM(total_distance) FROM (
+                        SELECT COUNT(*) as total_runs, COALESCE(SUM(distance), 0) as total_distance
+                        FROM runs WHERE user_id = ?
+                        UNION ALL
+                        SELECT COALESCE(SUM(runs_count), 0), COALESCE(SUM(total_distance), 0)
+                        FROM run_year_summary WHERE user_id = ?
+                    )
+                ''', (user_id, user_id))
             
-            result = cursor.fetchone()
-            if result and result[0]:
-                return {
-                    'total_runs': result[0],
-                    'total_distance': float(result[1])
-                }
-            return {'total_runs': 0, 'total_distance': 0}
+                result = cursor.fetchone()
+                if result and result[0]:
+                    return {
+                        'total_runs': result[0],
+                        'total_distance': float(result[1])
+                    }
+                return {'total_runs': 0, 'total_distance': 0}
         except Exception as e:
             logger.error(f"❌ Ошибка получения статистики: {e}")
             return {'total_runs': 0, 'total_distance': 0}
     
+    def get_user_runs(self, user_id: int):
+        """Вся история пробежек пользователя одним запросом"""
+        try:
+            with self.read_pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT date, distance, run_time_seconds, pace_seconds
+                    FROM runs WHERE user_id = ?
+                    ORDER BY date
+                ''', (user_id,))
+                return cursor.fetchall()
+        except Exception as e:
+            logger.error(f"❌ Ошибка получения истории пробежек: {e}")
+            return []
+    
     def get_weekly_top(self, days_back=7):
         """Получает топ бегунов за период - ИСПРАВЛЕННЫЙ ЗАПРОС"""
-        try:
-            cursor = self.conn.cursor()
-            end_date = datetime.now()
-            start_date = end_date - timedelta(days=days_back)
-            
-            logger.info(f"🔍 Поиск топа за период: {start_date} - {end_date}")
-            
-            # ВАЖНО: Используем date а не created_at
-            cursor.execute('''
+        end_date = datetime.now()
+        start_date = end_date - timedelta(days=days_back)
+        
+        logger.debug("🔍 Поиск топа за период: %s - %s", start_date, end_date)
+        
+        results = self.get_ranking(start_date, end_date, metric='distance', limit=10)
+        if results is None:
+            return [], None, None
+        
+        logger.debug("📊 Найдено записей в топе: %s", len(results))
+        return results, start_date, end_date
+    
+    def _ranking_cte(self, metric: str):
+        """CTE с агрегатами за период и позицией каждого бегуна по метрике"""
+        value_expr, order = RANKING_METRICS[metric]
+        # ВАЖНО: Используем date а не created_at
+        return f'''
+            WITH totals AS (
                 SELECT 
-                    u.first_name,
-                    u.last_name,
-                    u.username,
-                    COUNT(r.run_id) as runs_count,
-                    SUM(r.distance) as total_distance,
-                    AVG(r.distance) as avg_distance
-                FROM runs r
-                JOIN users u ON r.user_id = u.user_id
-                WHERE r.date >= ? AND r.date <= ?
-                GROUP BY u.user_id
-                ORDER BY total_distance DESC
-                LIMIT 10
-            ''', (start_date.strftime("%Y-%m-%d 00:00:00"), end_date.strftime("%Y-%m-%d 23:59:59")))
-            
-            results = cursor.fetchall()
-            logger.info(f"📊 Найдено записей в топе: {len(results)}")
-            
-            return results, start_date, end_date
-            
+                    user_id,
+                    COUNT(run_id) as runs_count,
+                    SUM(distance) as total_distance,
+                    AVG(distance) as avg_distance,
+                    SUM(run_time_seconds) as total_time,
+                    AVG(pace_seconds) as avg_pace
+                FROM runs
+                WHERE date >= ? AND date <= ?
+                GROUP BY user_id
+            ),
+            ranked AS (
+                SELECT 
+                    totals.*,
+                    {value_expr} as value,
+                    ROW_NUMBER() OVER (ORDER BY {value_expr} {order}, user_id) as position,
+                    COUNT(*) OVER () as total_ranked
+                FROM totals
+                WHERE {value_expr} IS NOT NULL
+            )
+        '''
+    
+    def get_ranking(self, start_date, end_date, metric: str = 'distance', limit: int = 10, offset: int = 0):
+        """Страница рейтинга за период по выбранной метрике"""
+        try:
+            with self.read_pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(self._ranking_cte(metric) + '''
+                    SELECT * FROM ranked
+                    ORDER BY position
+                    LIMIT ? OFFSET ?
+                ''', (start_date.strftime("%Y-%m-%d 00:00:00"), end_date.strftime("%Y-%m-%d 23:59:59"),
+                      limit, offset))
+                return cursor.fetchall()
         except Exception as e:
-            logger.error(f"❌ Ошибка получения топа: {e}")
-            return [], None, None
+            logger.error(f"❌ Ошибка получения рейтинга: {e}")
+            return None
+    
+    def get_user_rank(self, user_id: int, start_date, end_date, metric: str = 'distance', neighbours: int = 2):
+        """Позиция пользователя в рейтинге и его соседи сверху и снизу"""
+        try:
+            with self.read_pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(self._ranking_cte(metric) + '''
+                    , me AS (SELECT position FROM ranked WHERE user_id = ?)
+                    SELECT ranked.*
+                    FROM ranked
+                    JOIN me ON ranked.position BETWEEN me.position - ? AND me.position + ?
+                    ORDER BY ranked.position
+                ''', (start_date.strftime("%Y-%m-%d 00:00:00"), end_date.strftime("%Y-%m-%d 23:59:59"),
+                      user_id, neighbours, neighbours))
+                return cursor.fetchall()
+        except Exception as e:
+            logger.error(f"❌ Ошибка получения позиции в рейтинге: {e}")
+            return []
+    
+    def get_weekly_volume(self, weeks: int = 8):
+        """Суммарный объем клуба по неделям, от самой старой к текущей"""
+        volume = [0.0] * weeks
+        try:
+            end_date = datetime.now().strftime("%Y-%m-%d 23:59:59")
+            start_date = (datetime.now() - timedelta(days=weeks * 7 - 1)).strftime("%Y-%m-%d 00:00:00")
+            with self.read_pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT CAST((julianday(?) - julianday(date)) / 7 AS INTEGER) as weeks_ago,
+                           SUM(distance) as total_distance
+                    FROM runs
+                    WHERE date >= ? AND date <= ?
+                    GROUP BY weeks_ago
+                ''', (end_date, start_date, end_date))
+                for weeks_ago, total_distance in cursor.fetchall():
+                    if 0 <= weeks_ago < weeks:
+                        volume[weeks - 1 - weeks_ago] = float(total_distance)
+        except Exception as e:
+            logger.error(f"❌ Ошибка получения недельного объема: {e}")
+        return volume
     
     def get_all_stats(self):
         """Общая статистика"""
         try:
-            cursor = self.conn.cursor()
-            cursor.execute('SELECT COUNT(*), SUM(distance) FROM runs')
-            result = cursor.fetchone()
+            with self.read_pool.connection() as conn:
+                cursor = conn.cursor()
+                # Свежие пробежки плюс годовые итоги архива
+                cursor.execute('''
+                    SELECT SUM(total_runs), SUM(total_distance) FROM (
+                        SELECT COUNT(*) as total_runs, SUM(distance) as total_distance FROM runs
+                        UNION ALL
+                        SELECT SUM(runs_count), SUM(total_distance) FROM run_year_summary
+                    )
+                ''')
+                result = cursor.fetchone()
             
-            cursor.execute('SELECT COUNT(DISTINCT user_id) FROM runs')
-            active_users = cursor.fetchone()[0]
+                cursor.execute('''
+                    SELECT COUNT(*) FROM (
+                        SELECT user_id FROM runs UNION SELECT user_id FROM run_year_summary
+                    )
+                ''')
+                active_users = cursor.fetchone()[0]
             
-            stats = {
-                'total_runs': result[0] if result and result[0] else 0,
-                'total_distance': float(result[1]) if result and result[1] else 0,
-                'active_users': active_users
-            }
+                stats = {
+                    'total_runs': result[0] if result and result[0] else 0,
+                    'total_distance': float(result[1]) if result and result[1] else 0,
+                    'active_users': active_users
+                }
             
-            logger.info(f"📊 Общая статистика: {stats}")
-            return stats
+                logger.debug("📊 Общая статистика: %s", stats)
+                return stats
             
         except Exception as e:
             logger.error(f"❌ Ошибка получения общей статистики: {e}")
@@ -177,31 +542,94 @@ class Database:
     def debug_info(self):
         """Отладочная информация о базе"""
         try:
-            cursor = self.conn.cursor()
+            with self.read_pool.connection() as conn:
+                cursor = conn.cursor()
             
-            # Все таблицы
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-            tables = [row[0] for row in cursor.fetchall()]
+                # Все таблицы
+                cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
+                tables = [row[0] for row in cursor.fetchall()]
             
-            # Пользователи
-            cursor.execute("SELECT COUNT(*) FROM users")
-            users_count = cursor.fetchone()[0]
+                # Пользователи
+                cursor.execute("SELECT COUNT(*) FROM users")
+                users_count = cursor.fetchone()[0]
             
-            # Пробежки
-            cursor.execute("SELECT COUNT(*) FROM runs")
-            runs_count = cursor.fetchone()[0]
+                # Пробежки
+                cursor.execute("SELECT COUNT(*) FROM runs")
+                runs_count = cursor.fetchone()[0]
             
-            # Последние пробежки
-            cursor.execute("SELECT * FROM runs ORDER BY date DESC LIMIT 5")
-            recent_runs = cursor.fetchall()
+                # Последние пробежки
+                cursor.execute("SELECT * FROM runs ORDER BY date DESC LIMIT 5")
+                recent_runs = cursor.fetchall()
             
-            return {
-                'tables': tables,
-                'users_count': users_count,
-                'runs_count': runs_count,
-                'recent_runs': recent_runs
-            }
+                return {
+                    'tables': tables,
+                    'users_count': users_count,
+                    'runs_count': runs_count,
+                    'recent_runs': recent_runs
+                }
             
         except Exception as e:
             logger.error(f"❌ Ошибка отладки: {e}")
-            return {}
\ No newline at end of file
+            return {}
+    
+    def get_user_profiles(self):
+        """Имена всех пользователей для справочника UserDirectory"""
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT user_id, first_name, last_name, username FROM users")
+        return cursor.fetchall()
+    
+    def browse_users(self, after_id: int = None, before_id: int = None, limit: int = 10):
+        """Страница пользователей по user_id (keyset): после after_id или перед before_id"""
+        try:
+            with self.read_pool.connection() as conn:
+                cursor = conn.cursor()
+                if before_id is not None:
+                    cursor.execute('''
+                        SELECT user_id, first_name, last_name, username, registration_date FROM users
+                        WHERE user_id < ? ORDER BY user_id DESC LIMIT ?
+                    ''', (before_id, limit + 1))
+                else:
+                    cursor.execute('''
+                        SELECT user_id, first_name, last_name, username, registration_date FROM users
+                        WHERE user_id > ? ORDER BY user_id LIMIT ?
+                    ''', (after_id if after_id is not None else -1, limit + 1))
+                return cursor.fetchall()
+        except Exception as e:
+            logger.error(f"❌ Ошибка получения страницы пользователей: {e}")
+            return []
+    
+    def browse_runs(self, cursor_key=None, backward: bool = False, user_id: int = None,
+                    start_date: str = None, end_date: str = None, limit: int = 10):
+        """Страница пробежек от новых к старым (keyset по date, run_id)
+
+        cursor_key - (date, run_id) граничной записи; backward=True - предыдущая страница.
+        """
+        clauses, params = [], []
+        if user_id is not None:
+            clauses.append("user_id = ?")
+            params.append(user_id)
+        if start_date:
+            clauses.append("date >= ?")
+            params.append(start_date)
+        if end_date:
+            clauses.append("date <= ?")
+            params.append(end_date)
+        if cursor_key is not None:
+            clauses.append("(date, run_id) > (?, ?)" if backward else "(date, run_id) < (?, ?)")
+            params.extend(cursor_key)
+        
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        order = "ASC" if backward else "DESC"
+        try:
+            with self.read_pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(f'''
+                    SELECT run_id, user_id, distance, date, run_time, pace FROM runs
+                    {where}
+                    ORDER BY date {order}, run_id {order}
+                    LIMIT ?
+                ''', (*params, limit + 1))
+                return cursor.fetchall()
+        except Exception as e:
+            logger.error(f"❌ Ошибка получения страницы пробежек: {e}")
+            return []
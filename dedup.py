@@ -0,0 +1,26 @@
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class RecentUpdates:
+    """Ограниченное множество недавно обработанных update_id"""
+
+    def __init__(self, max_size: int = 1000):
+        self.max_size = max_size
+        self._ids = OrderedDict()
+
+    def check_and_add(self, update_id: int) -> bool:
+        """Возвращает True, если update уже обрабатывался; иначе запоминает его"""
+        if update_id in self._ids:
+            self._ids.move_to_end(update_id)
+            return True
+
+        self._ids[update_id] = None
+        if len(self._ids) > self.max_size:
+            self._ids.popitem(last=False)
+        return False
+
+    def __len__(self):
+        return len(self._ids)
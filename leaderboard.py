@@ -0,0 +1,135 @@
+import logging
+import threading
+from datetime import datetime
+from io import BytesIO
+from PIL import Image, ImageDraw, ImageFont
+
+logger = logging.getLogger(__name__)
+
+CHART_WEEKS = 8
+CHART_SIZE = (900, 520)
+BACKGROUND = (255, 255, 255)
+TEXT_COLOR = (40, 40, 40)
+GRID_COLOR = (225, 225, 225)
+VOLUME_COLOR = (70, 130, 180)
+RUNNER_COLOR = (255, 140, 0)
+
+# Подписи графика: встроенный шрифт Pillow знает только латиницу
+LABELS = {
+    True: {'volume': "Объем клуба по неделям, км", 'top': "Топ бегунов, км", 'now': "сейч.", 'weeks': "н"},
+    False: {'volume': "Weekly club volume, km", 'top': "Top runners, km", 'now': "now", 'weeks': "w"},
+}
+
+
+class LeaderboardRenderer:
+    """Готовые артефакты топа: HTML-текст, PNG-график и file_id загруженной картинки
+
+    Кэш по ключу (чат, окно, день) хранит версию данных; add_run увеличивает версию,
+    и только тогда топ перерисовывается. Повторная отправка того же графика идет по
+    file_id без новой загрузки.
+    """
+
+    def __init__(self, db, fetch_top, format_text, font_path: str = 'DejaVuSans.ttf'):
+        self.db = db
+        self.fetch_top = fetch_top
+        self.format_text = format_text
+        self.font_path = font_path
+        self.data_version = 0
+        self._cache = {}
+        self._lock = threading.Lock()
+        db.add_run_listener(self._on_run_added)
+
+    def _on_run_added(self, user_id: int):
+        with self._lock:
+            self.data_version += 1
+
+    def _key(self, chat_id: int, days_back: int):
+        # День в ключе: окно "последние N дней" сдвигается в полночь
+        return chat_id, days_back, datetime.now().strftime('%Y-%m-%d')
+
+    def get(self, chat_id: int, days_back: int = 7):
+        """Возвращает артефакты топа, перерисовывая их только после новых пробежек"""
+        key = self._key(chat_id, days_back)
+        with self._lock:
+            version = self.data_version
+            cached = self._cache.get(key)
+            if cached and cached['version'] == version:
+                return cached
+
+        top_runners, start_date, end_date = self.fetch_top(days_back)
+        artifacts = {
+            'version': version,
+            'text': self.format_text(top_runners, start_date, end_date),
+            'png': None,
+            'file_id': None,
+        }
+        if top_runners:
+            try:
+                weekly_volume = self.db.get_weekly_volume(CHART_WEEKS)
+                artifacts['png'] = self.render_chart(weekly_volume, top_runners)
+            except Exception as e:
+                # График - дополнение: текст топа уходит в любом случае
+                logger.error(f"❌ Не удалось нарисовать график топа: {e}")
+
+        with self._lock:
+            # Старые версии для этого ключа больше не нужны
+            self._cache = {k: v for k, v in self._cache.items() if k[:2] != key[:2]}
+            self._cache[key] = artifacts
+        logger.debug("🖼️ Топ перерисован: чат %s, окно %s дн., версия %s", chat_id, days_back, version)
+        return artifacts
+
+    def remember_file_id(self, artifacts, file_id: str):
+        """Запоминает file_id отправленного графика для повторной отправки без загрузки"""
+        artifacts['file_id'] = file_id
+
+    def _fonts(self):
+        """Возвращает (шрифт заголовков, шрифт подписей, есть ли кириллица)"""
+        try:
+            return ImageFont.truetype(self.font_path, 22), ImageFont.truetype(self.font_path, 14), True
+        except OSError:
+            logger.warning("⚠️ Шрифт %s не найден, график будет с латинскими подписями", self.font_path)
+            return ImageFont.load_default(), ImageFont.load_default(), False
+
+    def render_chart(self, weekly_volume, top_runners):
+        """Рисует PNG: объем клуба по неделям слева и топ бегунов справа"""
+        img = Image.new('RGB', CHART_SIZE, BACKGROUND)
+        draw = ImageDraw.Draw(img)
+        title_font, font, cyrillic = self._fonts()
+        labels = LABELS[cyrillic]
+
+        width, height = CHART_SIZE
+        draw.text((20, 15), labels['volume'], font=title_font, fill=TEXT_COLOR)
+        draw.text((width // 2 + 20, 15), labels['top'], font=title_font, fill=TEXT_COLOR)
+
+        # Левая панель: вертикальные столбцы, самая правая - текущая неделя
+        left, top, bottom = 30, 70, height - 50
+        panel_width = width // 2 - 60
+        max_volume = max(weekly_volume) or 1
+        bar_step = panel_width / len(weekly_volume)
+        draw.line((left, bottom, left + panel_width, bottom), fill=GRID_COLOR, width=2)
+        for i, volume in enumerate(weekly_volume):
+            x0 = left + i * bar_step + 6
+            x1 = left + (i + 1) * bar_step - 6
+            y0 = bottom - (bottom - top) * volume / max_volume
+            draw.rectangle((x0, y0, x1, bottom), fill=VOLUME_COLOR)
+            draw.text((x0, y0 - 18), f"{volume:.0f}", font=font, fill=TEXT_COLOR)
+            weeks_ago = len(weekly_volume) - 1 - i
+            week_label = labels['now'] if weeks_ago == 0 else f"-{weeks_ago}{labels['weeks']}"
+            draw.text((x0, bottom + 8), week_label, font=font, fill=TEXT_COLOR)
+
+        # Правая панель: горизонтальные полосы топа
+        left = width // 2 + 20
+        panel_width = width // 2 - 60
+        max_distance = max(runner['total_distance'] for runner in top_runners) or 1
+        row_height = (height - top - 30) / max(len(top_runners), 1)
+        for i, runner in enumerate(top_runners):
+            y = top + i * row_height
+            bar_width = (panel_width - 60) * runner['total_distance'] / max_distance
+            name = runner['name'] if cyrillic else runner['name'].encode('ascii', 'ignore').decode().strip()
+            draw.text((left, y), f"{i + 1}. {name}"[:40], font=font, fill=TEXT_COLOR)
+            draw.rectangle((left, y + 18, left + bar_width, y + row_height - 6), fill=RUNNER_COLOR)
+            draw.text((left + bar_width + 6, y + 18), f"{runner['total_distance']}", font=font, fill=TEXT_COLOR)
+
+        output = BytesIO()
+        img.save(output, format='PNG', optimize=True)
+        return output.getvalue()
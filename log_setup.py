@@ -0,0 +1,154 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+from contextvars import ContextVar
+
+# Поля, которые попадают в структурированную запись
+CONTEXT_FIELDS = ('update_id', 'chat_id', 'user_id', 'run_id')
+
+_log_context = ContextVar('log_context', default={})
+_listener = None
+
+
+def bind_context(**fields):
+    """Привязывает идентификаторы (update_id, user_id, ...) ко всем логам текущей задачи"""
+    _log_context.set({k: v for k, v in fields.items() if v is not None})
+
+
+def bind_update(update):
+    """Привязывает к логам идентификаторы из Telegram update"""
+    user = update.effective_user
+    chat = update.effective_chat
+    bind_context(
+        update_id=update.update_id,
+        chat_id=chat.id if chat else None,
+        user_id=user.id if user else None
+    )
+
+
+class ContextFilter(logging.Filter):
+    """Добавляет в запись идентификаторы из контекста, если их не передали через extra"""
+
+    def filter(self, record):
+        for key, value in _log_context.get().items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Пропускает только долю записей ниже WARNING для указанных категорий"""
+
+    def __init__(self, rates: dict):
+        super().__init__()
+        self.rates = rates
+
+    def _rate_for(self, name: str):
+        # Ищем самую точную категорию: "bot.ocr" -> "bot.ocr", затем "bot"
+        while name:
+            if name in self.rates:
+                return self.rates[name]
+            name = name.rpartition('.')[0]
+        return 1.0
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self._rate_for(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+
+class JsonFormatter(logging.Formatter):
+    """Форматирует запись в одну строку JSON"""
+
+    def format(self, record):
+        data = {
+            'ts': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                data[field] = value
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler, который откладывает форматирование до фонового потока"""
+
+    def prepare(self, record):
+        # Стандартный prepare форматирует сообщение в вызывающем потоке,
+        # а нам нужно, чтобы event loop только клал запись в очередь
+        return record
+
+
+def parse_levels(spec: str):
+    """Разбирает строку вида "database=WARNING,bot.ocr=DEBUG" """
+    levels = {}
+    for item in spec.split(','):
+        if '=' not in item:
+            continue
+        name, level = item.split('=', 1)
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def parse_rates(spec: str):
+    """Разбирает строку вида "database=0.1,bot.ocr=0.01" """
+    rates = {}
+    for item in spec.split(','):
+        if '=' not in item:
+            continue
+        name, rate = item.split('=', 1)
+        try:
+            rates[name.strip()] = max(0.0, min(1.0, float(rate)))
+        except ValueError:
+            continue
+    return rates
+
+
+def setup_logging(level: str = 'INFO', levels: str = '', sample_rates: str = '', fmt: str = 'json'):
+    """Настраивает неблокирующее логирование через очередь и фоновый поток"""
+    global _listener
+    if _listener is not None:
+        return
+
+    if fmt == 'json':
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = LazyQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(parse_rates(sample_rates)))
+    queue_handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    root.handlers.clear()
+    root.addHandler(queue_handler)
+    root.setLevel(level.upper())
+
+    for name, category_level in parse_levels(levels).items():
+        logging.getLogger(name).setLevel(category_level)
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Сбрасывает оставшиеся записи и останавливает фоновый поток"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,190 @@
+import gc
+import hashlib
+import json
+import logging
+import os
+import time
+from abc import ABC, abstractmethod
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+
+class OcrBackend(ABC):
+    """Базовый класс OCR-движка: принимает изображение (numpy array), возвращает текст"""
+
+    name = 'base'
+
+    @abstractmethod
+    def read_text(self, img_array) -> str:
+        ...
+
+
+class EasyOcrBackend(OcrBackend):
+    """easyocr на CPU с настраиваемыми языками, потоками и размером холста"""
+
+    def __init__(self, name='easyocr', languages=('ru', 'en'), threads=None, quantize=True, canvas_size=2560):
+        import easyocr
+
+        if threads:
+            # easyocr считает на torch, число потоков задается глобально
+            import torch
+            torch.set_num_threads(threads)
+
+        self.name = name
+        self.canvas_size = canvas_size
+        self.reader = easyocr.Reader(list(languages), gpu=False, quantize=quantize, verbose=False)
+
+    def read_text(self, img_array) -> str:
+        results = self.reader.readtext(img_array, detail=0, canvas_size=self.canvas_size)
+        return ' '.join(results)
+
+
+class TesseractBackend(OcrBackend):
+    """Tesseract через pytesseract - легче по памяти и быстрее на слабом CPU"""
+
+    def __init__(self, name='tesseract', languages='rus+eng', threads=None):
+        import pytesseract
+
+        if threads:
+            # Tesseract читает лимит потоков OpenMP из окружения
+            os.environ.setdefault('OMP_THREAD_LIMIT', str(threads))
+
+        self.name = name
+        self.languages = languages
+        self.pytesseract = pytesseract
+        # Проверяем, что бинарник tesseract установлен
+        self.pytesseract.get_tesseract_version()
+
+    def read_text(self, img_array) -> str:
+        return self.pytesseract.image_to_string(img_array, lang=self.languages, config='--psm 11')
+
+
+def create_backend(name: str, languages=('ru', 'en'), threads=None) -> OcrBackend:
+    """Создает OCR-движок по имени"""
+    if name == 'easyocr':
+        # Те же настройки, что у easyocr.Reader по умолчанию (квантованные модели на CPU)
+        return EasyOcrBackend('easyocr', languages, threads)
+    if name == 'easyocr-lite':
+        # Только латиница и уменьшенный холст
+        return EasyOcrBackend('easyocr-lite', ('en',), threads, canvas_size=1280)
+    if name == 'tesseract':
+        tesseract_langs = '+'.join({'ru': 'rus', 'en': 'eng'}.get(lang, lang) for lang in languages)
+        return TesseractBackend('tesseract', tesseract_langs, threads)
+    raise ValueError(f"❌ Неизвестный OCR-движок: {name}")
+
+
+BACKEND_NAMES = ('easyocr', 'easyocr-lite', 'tesseract')
+
+# Результат выбора "auto" сохраняется рядом с корпусом, чтобы не гонять бенчмарк при каждом старте
+SELECTION_FILE = 'selected_backend.json'
+
+
+def load_fixtures(fixtures_dir: str, preprocess):
+    """Загружает корпус: expected.json вида {"файл.jpg": дистанция_в_км}"""
+    with open(os.path.join(fixtures_dir, 'expected.json'), encoding='utf-8') as f:
+        expected = json.load(f)
+
+    fixtures = []
+    for filename, distance in expected.items():
+        img = preprocess(Image.open(os.path.join(fixtures_dir, filename)))
+        fixtures.append((filename, np.array(img), distance))
+    return fixtures
+
+
+def benchmark_backend(backend: OcrBackend, fixtures, parse_distance):
+    """Возвращает (точность, среднее время в секундах) на корпусе"""
+    correct = 0
+    started = time.perf_counter()
+    for filename, img_array, expected_distance in fixtures:
+        distance = parse_distance(backend.read_text(img_array))
+        if distance is not None and abs(distance - expected_distance) < 0.01:
+            correct += 1
+        else:
+            logger.debug("⚠️ %s: %s вместо %s", backend.name, distance, expected_distance)
+    elapsed = time.perf_counter() - started
+    return correct / len(fixtures), elapsed / len(fixtures)
+
+
+def _selection_key(fixtures_dir: str, names, min_accuracy: float, languages, threads) -> str:
+    """Отпечаток условий выбора: корпус, кандидаты и настройки"""
+    with open(os.path.join(fixtures_dir, 'expected.json'), 'rb') as f:
+        digest = hashlib.sha256(f.read())
+    digest.update(json.dumps([list(names), min_accuracy, list(languages), threads]).encode())
+    return digest.hexdigest()
+
+
+def _load_selection(fixtures_dir: str, key: str):
+    try:
+        with open(os.path.join(fixtures_dir, SELECTION_FILE), encoding='utf-8') as f:
+            selection = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return selection.get('backend') if selection.get('key') == key else None
+
+
+def _save_selection(fixtures_dir: str, key: str, name: str):
+    try:
+        with open(os.path.join(fixtures_dir, SELECTION_FILE), 'w', encoding='utf-8') as f:
+            json.dump({'key': key, 'backend': name}, f)
+    except OSError as e:
+        logger.warning("⚠️ Не удалось сохранить выбор OCR-движка: %s", e)
+
+
+def select_backend(names, fixtures_dir: str, preprocess, parse_distance, min_accuracy: float = 0.9,
+                   languages=('ru', 'en'), threads=None) -> OcrBackend:
+    """Выбирает самый быстрый движок, который проходит порог точности на корпусе
+
+    Движки проверяются по одному и сразу освобождаются, в памяти остается только
+    победитель. Выбор запоминается, пока не изменятся корпус или настройки.
+    """
+    key = _selection_key(fixtures_dir, names, min_accuracy, languages, threads)
+    chosen = _load_selection(fixtures_dir, key)
+    if chosen:
+        logger.info("✅ OCR-движок из сохраненного выбора: %s", chosen)
+        return create_backend(chosen, languages, threads)
+
+    fixtures = load_fixtures(fixtures_dir, preprocess)
+    if not fixtures:
+        raise ValueError(f"❌ Пустой корпус OCR в {fixtures_dir}")
+
+    results = []
+    for name in names:
+        try:
+            backend = create_backend(name, languages, threads)
+        except Exception as e:
+            logger.warning(f"⚠️ OCR-движок {name} недоступен: {e}")
+            continue
+
+        accuracy, latency = benchmark_backend(backend, fixtures, parse_distance)
+        logger.info("📊 OCR %s: точность %.0f%%, %.2f с/изображение", name, accuracy * 100, latency)
+        results.append((name, accuracy, latency))
+        # Модели easyocr занимают сотни МБ - не держим проигравших до конца выбора
+        del backend
+        gc.collect()
+
+    if not results:
+        raise RuntimeError("❌ Ни один OCR-движок не доступен")
+
+    passing = [r for r in results if r[1] >= min_accuracy]
+    if passing:
+        chosen = min(passing, key=lambda r: r[2])[0]
+    else:
+        # Никто не прошел порог - берем самый точный
+        chosen = max(results, key=lambda r: (r[1], -r[2]))[0]
+        logger.warning("⚠️ Ни один OCR-движок не достиг точности %.0f%%", min_accuracy * 100)
+
+    logger.info("✅ Выбран OCR-движок: %s", chosen)
+    _save_selection(fixtures_dir, key, chosen)
+    return create_backend(chosen, languages, threads)
+
+
+def load_backend(name: str, fixtures_dir: str, preprocess, parse_distance, min_accuracy: float = 0.9,
+                 languages=('ru', 'en'), threads=None) -> OcrBackend:
+    """Создает движок по имени; для "auto" выбирает лучший по корпусу"""
+    if name != 'auto':
+        return create_backend(name, languages, threads)
+    return select_backend(BACKEND_NAMES, fixtures_dir, preprocess, parse_distance,
+                          min_accuracy, languages, threads)
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+import asyncio
+import logging
+import multiprocessing
+import os
+import socket
+import sys
+from config import Config
+from database import Database
+from log_setup import setup_logging
+from ocr import load_backend
+from run_parser import RunParser
+from telegram import Bot
+
+logger = logging.getLogger('ocr_worker')
+
+class OcrWorker(RunParser):
+    """Воркер очереди OCR: забирает задания из ocr_jobs, распознает скриншоты и пишет результат"""
+
+    def __init__(self):
+        self.db = Database(read_pool_size=1, read_timeout=Config.READ_QUERY_TIMEOUT)
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.ocr = load_backend(
+            Config.OCR_BACKEND,
+            Config.OCR_FIXTURES_DIR,
+            preprocess=self.preprocess_image,
+            parse_distance=lambda text: self.extract_running_data(text)[0],
+            min_accuracy=Config.OCR_MIN_ACCURACY,
+            languages=Config.OCR_LANGUAGES,
+            threads=Config.OCR_THREADS
+        )
+
+    async def process_job(self, bot: Bot, job):
+        """Скачивает скриншот задания, распознает его и сохраняет результат"""
+        try:
+            file_obj = await bot.get_file(job['file_id'])
+            image_data = await file_obj.download_as_bytearray()
+            distance, time_info, pace, time_seconds, pace_seconds = self.recognize_run(image_data)
+
+            self.db.complete_ocr_job(job['job_id'], {
+                'distance': distance,
+                'time_info': time_info,
+                'pace': pace,
+                'time_seconds': time_seconds,
+                'pace_seconds': pace_seconds
+            })
+            logger.info("✅ OCR-задание %s выполнено: дистанция=%s", job['job_id'], distance)
+
+        except Exception as e:
+            # attempts уже увеличен при получении задания
+            retry = job['attempts'] + 1 < Config.OCR_MAX_ATTEMPTS
+            self.db.fail_ocr_job(job['job_id'], str(e), retry)
+            logger.error(f"❌ Ошибка OCR-задания {job['job_id']} (повтор: {retry}): {e}")
+
+    async def run(self):
+        """Основной цикл воркера"""
+        logger.info("🚀 OCR-воркер %s запущен", self.worker_id)
+        async with Bot(Config.BOT_TOKEN) as bot:
+            while True:
+                job = self.db.lease_ocr_job(self.worker_id, Config.OCR_LEASE_SECONDS, Config.OCR_MAX_ATTEMPTS)
+                if job is None:
+                    await asyncio.sleep(Config.OCR_POLL_INTERVAL)
+                    continue
+                await self.process_job(bot, job)
+
+def run_worker():
+    setup_logging(
+        level=Config.LOG_LEVEL,
+        levels=Config.LOG_LEVELS,
+        sample_rates=Config.LOG_SAMPLE_RATES,
+        fmt=Config.LOG_FORMAT
+    )
+    asyncio.run(OcrWorker().run())
+
+if __name__ == "__main__":
+    # python ocr_worker.py [число процессов]
+    processes = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+    if processes == 1:
+        run_worker()
+    else:
+        workers = [multiprocessing.Process(target=run_worker) for _ in range(processes)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
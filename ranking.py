@@ -0,0 +1,117 @@
+import logging
+import re
+from datetime import datetime, timedelta
+
+from tiering import archive_horizon
+
+logger = logging.getLogger(__name__)
+
+# Окна рейтинга: количество дней назад от текущего момента
+WINDOWS = {
+    'week': 7,
+    'month': 30,
+    'year': 365,
+}
+
+WINDOW_NAMES = {
+    'week': 'неделя',
+    'month': 'месяц',
+    'year': 'год',
+    'custom': 'период',
+}
+
+METRIC_NAMES = {
+    'distance': 'дистанция',
+    'runs': 'пробежки',
+    'time': 'время',
+    'pace': 'средний темп',
+}
+
+PAGE_SIZE = 10
+
+DATE_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+
+class RankingEngine:
+    """Рейтинги за произвольные периоды по разным метрикам"""
+
+    def __init__(self, db, users, archive_after_days: int = 400):
+        self.db = db
+        self.users = users
+        self.archive_after_days = archive_after_days
+
+    def resolve_window(self, window: str = 'week', start_date=None, end_date=None):
+        """Возвращает (start_date, end_date) для окна или своего периода"""
+        if window == 'custom':
+            if not start_date or not end_date or start_date > end_date:
+                raise ValueError("❌ Для своего периода нужны даты начала и конца")
+            return start_date, end_date
+
+        if window not in WINDOWS:
+            raise ValueError(f"❌ Неизвестный период: {window}")
+
+        end_date = datetime.now()
+        return end_date - timedelta(days=WINDOWS[window]), end_date
+
+    def parse_args(self, args):
+        """Разбирает аргументы команды: [week|month|year|ГГГГ-ММ-ДД ГГГГ-ММ-ДД] [метрика] [страница]"""
+        window, metric, page = 'week', 'distance', 1
+        start_date = end_date = None
+        args = list(args or [])
+
+        if len(args) >= 2 and DATE_PATTERN.match(args[0]) and DATE_PATTERN.match(args[1]):
+            window = 'custom'
+            start_date = datetime.strptime(args.pop(0), "%Y-%m-%d")
+            end_date = datetime.strptime(args.pop(0), "%Y-%m-%d")
+
+        for arg in args:
+            arg = arg.lower()
+            if arg in WINDOWS:
+                window = arg
+            elif arg in METRIC_NAMES:
+                metric = arg
+            elif arg.isdigit() and int(arg) > 0:
+                page = int(arg)
+            else:
+                raise ValueError(f"❌ Непонятный аргумент: {arg}")
+
+        start_date, end_date = self.resolve_window(window, start_date, end_date)
+        return window, metric, page, start_date, end_date
+
+    def top(self, start_date, end_date, metric: str = 'distance', page: int = 1, page_size: int = PAGE_SIZE):
+        """Страница рейтинга"""
+        rows = self.db.get_ranking(start_date, end_date, metric, limit=page_size, offset=(page - 1) * page_size)
+        return rows or []
+
+    def my_rank(self, user_id: int, start_date, end_date, metric: str = 'distance', neighbours: int = 2):
+        """Позиция пользователя и соседи; пустой список, если он не бегал в этот период"""
+        return self.db.get_user_rank(user_id, start_date, end_date, metric, neighbours)
+
+    def format_value(self, row, metric: str):
+        """Значение метрики для вывода"""
+        if metric == 'distance':
+            return f"{row['total_distance']:.1f} км"
+        if metric == 'runs':
+            return f"{row['runs_count']} пробежек"
+        seconds = int(row['value'])
+        if metric == 'pace':
+            return f"{seconds // 60}:{seconds % 60:02d}/км"
+        hours, rest = divmod(seconds, 3600)
+        return f"{hours}:{rest // 60:02d}:{rest % 60:02d}"
+
+    def format_name(self, row):
+        """Имя бегуна как в топе - из справочника пользователей"""
+        return self.users.display_name(row['user_id'])
+
+    def archive_note(self, start_date):
+        """Предупреждение, если период заходит в архив: рейтинг считается только по горячей таблице"""
+        horizon = archive_horizon(self.archive_after_days)
+        if start_date < horizon:
+            return f"⚠️ Пробежки до {horizon.strftime('%d.%m.%Y')} перенесены в архив и в рейтинг не входят"
+        return None
+
+    def format_header(self, window: str, metric: str, start_date, end_date):
+        return (
+            f"🏆 <b>РЕЙТИНГ</b>: {WINDOW_NAMES[window]}, {METRIC_NAMES[metric]}\n"
+            f"📅 Период: {start_date.strftime('%d.%m.%Y')} - {end_date.strftime('%d.%m.%Y')}"
+        )
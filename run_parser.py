@@ -0,0 +1,257 @@
+import logging
+import re
+from io import BytesIO
+from PIL import Image, ImageEnhance
+import numpy as np
+
+ocr_logger = logging.getLogger('bot.ocr')
+
+class RunParser:
+    """Разбор пробежки из текста сообщения и распознанного скриншота"""
+    
+    def extract_distance_from_text(self, message):
+        """Извлекает дистанцию из текстового сообщения"""
+        clean_message = re.sub(r'#япобегал', '', message, flags=re.IGNORECASE)
+        clean_message = re.sub(r'\s+', ' ', clean_message).strip()
+        
+        patterns = [
+            r'(\d+[.,]?\d*)\s*км',
+            r'(\d+[.,]?\d*)\s*km',
+        ]
+
+        for pattern in patterns:
+            match = re.search(pattern, clean_message, re.IGNORECASE)
+            if match:
+                try:
+                    distance_str = match.group(1).replace(',', '.')
+                    distance = float(distance_str)
+                    if 0.1 <= distance <= 100:
+                        return distance
+                except ValueError:
+                    continue
+
+        return None
+
+    def preprocess_image(self, img):
+        """Улучшение качества изображения - ПОЛНАЯ ВЕРСИЯ"""
+        img = img.convert('L')
+        enhancer = ImageEnhance.Contrast(img)
+        img = enhancer.enhance(3.0)
+        enhancer = ImageEnhance.Sharpness(img)
+        img = enhancer.enhance(3.0)
+        return img
+
+    def parse_time_to_seconds(self, time_str):
+        """Парсит время в секунды"""
+        if not time_str:
+            return None
+            
+        time_str = time_str.replace('.', ':').replace(';', ':')
+        parts = time_str.split(':')
+        
+        if len(parts) == 3:
+            try:
+                hours, minutes, seconds = map(int, parts)
+                if hours < 24 and minutes < 60 and seconds < 60:
+                    return hours * 3600 + minutes * 60 + seconds
+            except ValueError:
+                return None
+                
+        elif len(parts) == 2:
+            try:
+                minutes, seconds = map(int, parts)
+                if minutes < 60 and seconds < 60:
+                    return minutes * 60 + seconds
+            except ValueError:
+                return None
+                
+        return None
+
+    def seconds_to_time_format(self, seconds):
+        """Конвертирует секунды в формат ЧЧ:ММ:СС или ММ:СС"""
+        if not seconds:
+            return None
+            
+        hours = int(seconds // 3600)
+        minutes = int((seconds % 3600) // 60)
+        seconds = int(seconds % 60)
+        
+        if hours > 0:
+            return f"{hours}:{minutes:02d}:{seconds:02d}"
+        else:
+            return f"{minutes}:{seconds:02d}"
+
+    def seconds_to_pace_format(self, seconds):
+        """Конвертирует секунды в формат темпа ММ:СС"""
+        if not seconds:
+            return None
+        minutes = int(seconds // 60)
+        seconds = int(seconds % 60)
+        return f"{minutes}:{seconds:02d}"
+
+    def extract_running_data(self, extracted_text):
+        """Умное извлечение данных о пробежке с расчетом недостающих значений - ПОЛНАЯ ВЕРСИЯ"""
+        ocr_logger.debug("🔍 Распознанный текст: %s", extracted_text)
+        
+        extracted_text = re.sub(r'[<>&]', ' ', extracted_text)
+        extracted_text = re.sub(r'\s+', ' ', extracted_text).strip()
+        
+        distance = None
+        time_str = None
+        pace_str = None
+        time_seconds = None
+        pace_seconds = None
+        
+        # 1. ПОИСК ДИСТАНЦИИ
+        distance_patterns = [
+            r'(\d+[.,]\d+)\s*km',
+            r'(\d+[.,]\d+)\s*км',
+            r'(\d+[.,]\d+)km',
+            r'(\d+[.,]\d+)км',
+            r'расстояние[^\d]*(\d+[.,]\d+)',
+            r'дистанция[^\d]*(\d+[.,]\d+)',
+        ]
+        
+        for pattern in distance_patterns:
+            match = re.search(pattern, extracted_text, re.IGNORECASE)
+            if match:
+                try:
+                    dist = float(match.group(1).replace(',', '.'))
+                    if 0.5 <= dist <= 42.2:
+                        distance = dist
+                        ocr_logger.debug("✅ Найдена дистанция: %s км", distance)
+                        break
+                except ValueError:
+                    continue
+        
+        # Резервный поиск дистанции
+        if not distance:
+            number_pattern = r'\b(1[0-5][.,]\d{1,2})\b'
+            matches = re.findall(number_pattern, extracted_text)
+            for match in matches:
+                try:
+                    dist = float(match.replace(',', '.'))
+                    if 5.0 <= dist <= 20.0:
+                        context = extracted_text.lower()
+                        if not any(word in context for word in ['пульс', 'калори', 'уд/м', 'kcal']):
+                            distance = dist
+                            ocr_logger.debug("✅ Найдена дистанция (резерв): %s км", distance)
+                            break
+                except ValueError:
+                    continue
+        
+        # 2. ПОИСК ВРЕМЕНИ
+        time_patterns = [
+            r'(\d+:\d+:\d+)',
+            r'(\d+:\d+)',
+            r'общее\s+время[^\d]*(\d+:\d+:\d+)',
+            r'время[^\d]*(\d+:\d+:\d+)',
+            r'общее\s+время[^\d]*(\d+:\d+)',
+            r'время[^\d]*(\d+:\d+)',
+        ]
+        
+        for pattern in time_patterns:
+            match = re.search(pattern, extracted_text, re.IGNORECASE)
+            if match:
+                candidate = match.group(1)
+                seconds = self.parse_time_to_seconds(candidate)
+                if seconds and seconds >= 60:
+                    time_str = candidate
+                    time_seconds = seconds
+                    ocr_logger.debug("✅ Найдено время: %s (%s сек)", time_str, time_seconds)
+                    break
+        
+        if not time_str:
+            all_time_matches = re.findall(r'\b\d{1,2}:\d{2}(?::\d{2})?\b', extracted_text)
+            for match in all_time_matches:
+                seconds = self.parse_time_to_seconds(match)
+                if seconds and seconds >= 180:
+                    time_str = match
+                    time_seconds = seconds
+                    ocr_logger.debug("✅ Найдено время (общий поиск): %s", time_str)
+                    break
+        
+        # 3. ПОИСК ТЕМПА
+        pace_patterns = [
+            (r'(\d{3})"\s*/\s*km', True),
+            (r'(\d{3})"\s*/\s*км', True),
+            (r'(\d+:\d+)\s*/\s*km', False),
+            (r'(\d+:\d+)\s*/\s*км', False),
+            (r"(\d+)'(\d+)''?", True),
+            (r'средн\.?\s*темп[^\d]*(\d+:\d+)', False),
+            (r'средний\s*темп[^\d]*(\d+:\d+)', False),
+        ]
+        
+        for pattern, needs_conversion in pace_patterns:
+            match = re.search(pattern, extracted_text, re.IGNORECASE)
+            if match:
+                if needs_conversion:
+                    if pattern.startswith(r'(\d{3})"'):
+                        num = match.group(1)
+                        if len(num) == 3:
+                            minutes = int(num[0])
+                            seconds = int(num[1:])
+                            if seconds < 60:
+                                pace_seconds = minutes * 60 + seconds
+                                pace_str = f"{minutes}:{seconds:02d}"
+                                ocr_logger.debug("✅ Найден темп (3 цифры): %s", pace_str)
+                                break
+                    elif pattern.startswith(r"(\d+)'(\d+)''?"):
+                        minutes, seconds = match.groups()
+                        pace_seconds = int(minutes) * 60 + int(seconds)
+                        pace_str = f"{minutes}:{seconds}"
+                        ocr_logger.debug("✅ Найден темп (минуты'секунды): %s", pace_str)
+                        break
+                else:
+                    pace_candidate = match.group(1)
+                    pace_seconds_candidate = self.parse_time_to_seconds(pace_candidate)
+                    if pace_seconds_candidate and 120 <= pace_seconds_candidate <= 1200:
+                        pace_seconds = pace_seconds_candidate
+                        pace_str = pace_candidate
+                        ocr_logger.debug("✅ Найден темп: %s", pace_str)
+                        break
+        
+        # 4. УМНЫЙ РАСЧЕТ НЕДОСТАЮЩИХ ДАННЫХ
+        calculated_time = None
+        calculated_pace = None
+        
+        if distance:
+            if time_seconds and not pace_seconds:
+                pace_seconds = time_seconds / distance
+                if 120 <= pace_seconds <= 1200:
+                    calculated_pace = self.seconds_to_pace_format(pace_seconds)
+                    pace_str = calculated_pace
+                    ocr_logger.debug("🧮 ВЫЧИСЛЕН темп: %s из времени %s и дистанции %sкм", pace_str, time_str, distance)
+            
+            elif pace_seconds and not time_seconds:
+                time_seconds = pace_seconds * distance
+                if 60 <= time_seconds <= 36000:
+                    calculated_time = self.seconds_to_time_format(time_seconds)
+                    time_str = calculated_time
+                    ocr_logger.debug("🧮 ВЫЧИСЛЕНО время: %s из темпа %s и дистанции %sкм", time_str, pace_str, distance)
+            
+            elif not time_seconds and not pace_seconds:
+                estimated_pace_seconds = 360
+                time_seconds = estimated_pace_seconds * distance
+                if 60 <= time_seconds <= 36000:
+                    calculated_time = self.seconds_to_time_format(time_seconds)
+                    time_str = calculated_time
+                    pace_str = "6:00"
+                    ocr_logger.debug("🧮 ВЫЧИСЛЕНО примерное время: %s (темп 6:00/км)", time_str)
+        
+        if calculated_time and time_str:
+            time_str = f"{time_str} (вычислено)"
+        
+        if calculated_pace and pace_str:
+            pace_str = f"{pace_str} (вычислено)"
+        
+        ocr_logger.info("📊 ИТОГОВЫЕ ДАННЫЕ: дистанция=%s, время=%s, темп=%s", distance, time_str, pace_str)
+        
+        return distance, time_str, pace_str, time_seconds, pace_seconds
+
+    def recognize_run(self, image_data):
+        """Распознает пробежку на скриншоте: предобработка, OCR (self.ocr) и разбор текста"""
+        img = Image.open(BytesIO(image_data))
+        img = self.preprocess_image(img)
+        extracted_text = self.ocr.read_text(np.array(img))
+        return self.extract_running_data(extracted_text)
@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+RUN_COLUMNS = ('run_id, user_id, distance, date, message_id, chat_id, '
+               'run_time, pace, run_time_seconds, pace_seconds')
+
+
+def archive_horizon(archive_after_days: int) -> datetime:
+    """Граница архива: пробежки раньше нее могут лежать в runs_archive_<год>"""
+    return (datetime.now() - timedelta(days=archive_after_days)).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+class RunArchiver:
+    """Перенос старых пробежек в годовые архивные таблицы и обслуживание базы
+
+    Горячая таблица runs хранит только последние archive_after_days дней; все, что старше,
+    уезжает в runs_archive_<год>, а в run_year_summary копятся годовые итоги для общей
+    статистики. Работа идет небольшими пачками в отдельном потоке на своем соединении:
+    транзакции пачек не смешиваются с записью бота, а event loop не блокируется.
+    """
+
+    def __init__(self, db, archive_after_days: int = 400, batch_size: int = 500, vacuum_pages: int = 200):
+        self.db = db
+        self.archive_after_days = archive_after_days
+        self.batch_size = batch_size
+        self.vacuum_pages = vacuum_pages
+        self.conn = sqlite3.connect(db.db_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+
+    def _ensure_archive_table(self, year: int):
+        self.conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS runs_archive_{year} (
+                run_id INTEGER PRIMARY KEY,
+                user_id INTEGER,
+                distance REAL,
+                date TIMESTAMP,
+                message_id INTEGER,
+                chat_id INTEGER,
+                run_time TEXT,
+                pace TEXT,
+                run_time_seconds INTEGER,
+                pace_seconds INTEGER
+            )
+        ''')
+        self.conn.execute(
+            f'CREATE INDEX IF NOT EXISTS idx_runs_archive_{year}_user ON runs_archive_{year} (user_id, date)'
+        )
+
+    def archive_batch(self, horizon: str):
+        """Переносит одну пачку пробежек старше horizon; возвращает число перенесенных"""
+        conn = self.conn
+        rows = conn.execute('''
+            SELECT run_id, CAST(substr(date, 1, 4) AS INTEGER) as year FROM runs
+            WHERE date < ?
+            ORDER BY date
+            LIMIT ?
+        ''', (horizon, self.batch_size)).fetchall()
+        if not rows:
+            return 0
+
+        by_year = {}
+        for row in rows:
+            by_year.setdefault(row['year'], []).append(row['run_id'])
+
+        for year in by_year:
+            self._ensure_archive_table(year)
+
+        try:
+            for year, run_ids in by_year.items():
+                placeholders = ','.join('?' * len(run_ids))
+                conn.execute(f'''
+                    INSERT OR IGNORE INTO runs_archive_{year} ({RUN_COLUMNS})
+                    SELECT {RUN_COLUMNS} FROM runs WHERE run_id IN ({placeholders})
+                ''', run_ids)
+                conn.execute(f'''
+                    INSERT INTO run_year_summary (user_id, year, runs_count, total_distance, total_time)
+                    SELECT user_id, ?, COUNT(*), COALESCE(SUM(distance), 0), COALESCE(SUM(run_time_seconds), 0)
+                    FROM runs WHERE run_id IN ({placeholders})
+                    GROUP BY user_id
+                    ON CONFLICT (user_id, year) DO UPDATE SET
+                        runs_count = runs_count + excluded.runs_count,
+                        total_distance = total_distance + excluded.total_distance,
+                        total_time = total_time + excluded.total_time
+                ''', (year, *run_ids))
+                conn.execute(f'DELETE FROM runs WHERE run_id IN ({placeholders})', run_ids)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        return len(rows)
+
+    async def archive_old_runs(self):
+        """Переносит все пробежки старше горизонта; возвращает их число"""
+        horizon = archive_horizon(self.archive_after_days).strftime("%Y-%m-%d %H:%M:%S")
+        started = time.perf_counter()
+        total = 0
+        while True:
+            # Каждая пачка - короткая транзакция в потоке; между ними пишет бот
+            moved = await asyncio.to_thread(self.archive_batch, horizon)
+            if not moved:
+                break
+            total += moved
+
+        if total:
+            logger.info("📦 В архив перенесено пробежек: %s за %.1f с", total, time.perf_counter() - started)
+        return total
+
+    def _vacuum_step(self):
+        """Один шаг инкрементального VACUUM; возвращает, остались ли свободные страницы"""
+        if self.conn.execute("PRAGMA freelist_count").fetchone()[0] == 0:
+            return False
+        # executescript проходит прагму до конца; execute освобождает только одну страницу
+        self.conn.executescript(f"PRAGMA incremental_vacuum({self.vacuum_pages});")
+        return True
+
+    def _analyze(self):
+        # analysis_limit ограничивает ANALYZE выборкой строк, чтобы он не сканировал всю базу
+        self.conn.executescript("PRAGMA analysis_limit=1000; ANALYZE; PRAGMA optimize;")
+
+    async def vacuum_and_analyze(self):
+        """Возвращает свободные страницы файлу по частям и обновляет статистику планировщика"""
+        auto_vacuum = await asyncio.to_thread(lambda: self.conn.execute("PRAGMA auto_vacuum").fetchone()[0])
+        freed = 0
+        if auto_vacuum != 2:
+            # Полный VACUUM блокирует запись на все время работы - только вручную при остановленном боте
+            logger.warning("⚠️ Инкрементальный VACUUM выключен; остановите бота и выполните python tiering.py")
+        else:
+            while await asyncio.to_thread(self._vacuum_step):
+                freed += self.vacuum_pages
+
+        await asyncio.to_thread(self._analyze)
+        if freed:
+            logger.info("🧹 Освобождено страниц: до %s", freed)
+
+
+def enable_incremental_vacuum(db_path: str = 'workouts.db'):
+    """Переводит базу, созданную до auto_vacuum=INCREMENTAL, на инкрементальный режим
+
+    Нужен один полный VACUUM: он переписывает весь файл и держит блокировку записи,
+    поэтому запускается отдельно, когда бот остановлен.
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            print("✅ Инкрементальный VACUUM уже включен")
+            return
+        started = time.perf_counter()
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+        print(f"✅ База переведена на инкрементальный VACUUM за {time.perf_counter() - started:.1f} с")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    enable_incremental_vacuum(*sys.argv[1:2])
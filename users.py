@@ -0,0 +1,52 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class UserDirectory:
+    """Кэш известных пользователей: user_id -> (first_name, last_name, username)
+
+    В базу пишем только новых пользователей и изменившиеся профили.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._lock = threading.Lock()
+        self._profiles = {row['user_id']: (row['first_name'], row['last_name'], row['username'])
+                          for row in db.get_user_profiles()}
+        logger.info("✅ Загружено пользователей в справочник: %s", len(self._profiles))
+
+    def ensure(self, user_id: int, first_name: str, last_name: str = None, username: str = None):
+        """Сохраняет пользователя, если он новый или поменял имя; иначе ничего не пишет"""
+        profile = (first_name, last_name, username)
+        if self._profiles.get(user_id) == profile:
+            return True
+
+        if not self.db.add_user(user_id, first_name, last_name, username):
+            return False
+
+        with self._lock:
+            self._profiles[user_id] = profile
+        return True
+
+    def get(self, user_id: int):
+        """Профиль пользователя или None"""
+        return self._profiles.get(user_id)
+
+    def display_name(self, user_id: int):
+        """Имя для рейтингов: "Имя Фамилия (@username)" """
+        profile = self._profiles.get(user_id)
+        if not profile or not profile[0]:
+            return str(user_id)
+
+        first_name, last_name, username = profile
+        name = first_name
+        if last_name:
+            name += f" {last_name}"
+        if username:
+            name += f" (@{username})"
+        return name
+
+    def __len__(self):
+        return len(self._profiles)